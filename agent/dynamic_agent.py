@@ -1,10 +1,197 @@
+import asyncio
+import hashlib
 import json
 import requests
 import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from requests.adapters import HTTPAdapter
 from sqlalchemy import text, exc
-from typing import Dict, List, Any
+from typing import Dict, List, Any, FrozenSet, NamedTuple, Tuple
+from urllib3.util.retry import Retry
+
+from database.db_manager import POOL_SIZE, MAX_OVERFLOW
+from database.sql_parser import analyze_select, extract_table_references, tokenize
+
+# orjson encodes the request body and decodes the streamed response chunks
+# noticeably faster when available
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    json_loads = json.loads
+    
+    def json_dumps(obj):
+        return json.dumps(obj).encode()
+
+# Request body is sent pre-encoded, so its content type has to be set explicitly
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# (connect, read) timeouts in seconds for calls to the Ollama API
+OLLAMA_TIMEOUT = (3, 120)
+
+# How long Ollama keeps the model loaded after a request, so questions that
+# arrive a few minutes apart don't pay for reloading it
+OLLAMA_KEEP_ALIVE = "10m"
+
+# Questions sent to the model in one prompt by run_batch(); answer quality
+# drops off as the list grows, so larger inputs are split into several prompts
+BATCH_SIZE = 8
+
+# Number of generated SQL queries remembered across agents, so a question asked
+# again against the same schema and model skips the model call
+SQL_CACHE_SIZE = 512
+
+# Pre-compiled patterns used to inspect generated SQL
+_FROM_RE = re.compile(r'\bFROM\s+([A-Za-z_][\w]*)', re.IGNORECASE)
+_UPDATE_RE = re.compile(r'\bUPDATE\s+([A-Za-z_][\w]*)', re.IGNORECASE)
+_INTO_RE = re.compile(r'\bINTO\s+([A-Za-z_][\w]*)', re.IGNORECASE)
+_WHERE_RE = re.compile(r'\bWHERE\b', re.IGNORECASE)
+
+# Leading keyword -> query type reported by DynamicAgent._detect_query_type
+_KIND_MAP = (
+    ("SELECT", "SELECT"),
+    ("INSERT", "INSERT"),
+    ("UPDATE", "UPDATE"),
+    ("DELETE", "DELETE"),
+    ("SHOW", "SHOW"),
+    ("DESCRIBE", "SHOW"),
+)
+# Body of a fenced code block; the closing fence may be missing
+_SQL_BLOCK_RE = re.compile(r'```(?:sql)?\s*(.*?)(?:```|$)', re.IGNORECASE | re.DOTALL)
+
+@lru_cache(maxsize=1024)
+def _find_main_table(query):
+    """Extract the main table from a SQL query (memoized on the query text)"""
+    keyword = query.lstrip()[:6].upper()
+    
+    if keyword == "SELECT":
+        # Skip FROM clauses that belong to subqueries
+        select_parts = analyze_select(query)
+        return select_parts["main_table"] if select_parts else None
+    elif keyword == "UPDATE":
+        match = _UPDATE_RE.search(query)
+    elif keyword == "INSERT":
+        match = _INTO_RE.search(query)
+    else:
+        # DELETE queries name their table after FROM
+        match = _FROM_RE.search(query)
+    
+    return match.group(1) if match else None
+
+def _encode_json_string_content(value):
+    """
+    JSON-encode a string without its surrounding quotes
+    
+    Escaping is per character, so encoded pieces can be concatenated into one
+    JSON string.
+    """
+    return json_dumps(value)[1:-1]
+
+class _StatementEndScanner:
+    """
+    Watch streamed model output for the end of the SQL statement
+    
+    The statement ends at a semicolon outside string literals and quoted
+    identifiers, or at the code fence closing the SQL block. Text is fed in
+    as it arrives, so tokens may split quotes and fences anywhere.
+    """
+    def __init__(self):
+        self.quote = None
+        self.escaped = False
+        self.backticks = 0
+        self.fences = 0
+    
+    def feed(self, text):
+        """
+        Scan the next piece of output
+        
+        Args:
+            text: Text received since the previous call
+            
+        Returns:
+            True once the statement is complete
+        """
+        for char in text:
+            if char == "`":
+                # Three backticks are a fence, whatever came before them;
+                # prose before an opening fence can leave a stray apostrophe
+                self.backticks += 1
+                if self.backticks == 3:
+                    self.backticks = 0
+                    self.fences += 1
+                    self.quote = None
+                    self.escaped = False
+                    if self.fences >= 2:
+                        return True
+                continue
+            
+            if self.backticks:
+                # A single backtick opens or closes a quoted identifier
+                if self.backticks == 1 and self.quote in (None, "`"):
+                    self.quote = None if self.quote else "`"
+                self.backticks = 0
+            
+            if self.escaped:
+                self.escaped = False
+            elif self.quote:
+                if char == "\\" and self.quote != "`":
+                    self.escaped = True
+                elif char == self.quote:
+                    self.quote = None
+            elif char in "'\"":
+                self.quote = char
+            elif char == ";":
+                return True
+        
+        return False
+
+class _SchemaBundle(NamedTuple):
+    """Schema details and pre-rendered prompt text shared by agents on one engine"""
+    tables_description: str
+    schema: Dict[str, Dict[str, Any]]
+    foreign_keys: Dict[str, List[Dict[str, Any]]]
+    join_hints: str
+    table_columns: Dict[str, Tuple[str, ...]]
+    table_names_ci: Dict[str, str]
+    referenced_tables: FrozenSet[str]
+    schema_fingerprint: str
+    prompt_prefix: str
+    prompt_suffix: str
+    encoded_prompt_prefix: bytes
+    encoded_prompt_suffix: bytes
+    batch_prompt_prefix: str
+    batch_prompt_suffix: str
+
+def _build_ollama_session():
+    """Create an HTTP session that keeps connections to Ollama alive between requests"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=50,
+        max_retries=Retry(total=2, backoff_factor=0.2)
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 class DynamicAgent:
+    # Shared by all agents so connections to Ollama are pooled across requests
+    session = _build_ollama_session()
+    
+    # Worker threads for arun(), bounded by what the connection pool can serve
+    # so queued requests wait here rather than on a pool checkout
+    _executor = ThreadPoolExecutor(max_workers=POOL_SIZE + MAX_OVERFLOW)
+    
+    # Schema bundles keyed by engine id, reused by every agent on that engine
+    _schema_cache: Dict[str, _SchemaBundle] = {}
+    
+    # Generated SQL keyed by (schema fingerprint, model, normalized question),
+    # least recently used first
+    _sql_cache: "OrderedDict[Tuple[str, str, str], str]" = OrderedDict()
+    _sql_cache_lock = threading.Lock()
+    
     def __init__(self, db_manager, db_config, model_name="llama3"):
         """
         Initialize an agent that uses Ollama for language model inference
@@ -22,49 +209,137 @@ class DynamicAgent:
         
         # Get engine and schema description
         self.engine = self.db_manager.get_connection(db_config)
-        self.tables_description = self.db_manager.get_tables_description(self.engine)
-        self.schema = self.db_manager.get_tables_schema(self.engine)
-        self.foreign_keys = self.db_manager.get_foreign_keys(self.engine)
-        self.join_hints = self.db_manager.generate_join_hints(self.engine)
+        
+        # Agents built for the same database share one copy of the schema
+        # instead of introspecting again. The db_manager hands out a new schema
+        # dict once its cached one expires or is refreshed, so a bundle built
+        # from another one is stale
+        engine_id = str(id(self.engine))
+        bundle = self._schema_cache.get(engine_id)
+        if bundle is None or bundle.schema is not self.db_manager.get_tables_schema(self.engine):
+            bundle = self._load_schema_bundle()
+            self._schema_cache[engine_id] = bundle
+        
+        self.tables_description = bundle.tables_description
+        self.schema = bundle.schema
+        self.foreign_keys = bundle.foreign_keys
+        self.join_hints = bundle.join_hints
         
         # Map of table names to their possible column names
+        self.table_columns = bundle.table_columns
+        
+        # Lowercased table names mapped to their schema spelling
+        self._schema_ci = bundle.table_names_ci
+        
+        # Tables that other tables point at through a foreign key
+        self._referenced_tables = bundle.referenced_tables
+        
+        # What SHOW TABLES would return, answered from the schema so error
+        # responses don't need another database round-trip
+        header = f"Tables_in_{db_config.get('database', '')}"
+        self._tables_listing = "\n".join([header, "-" * len(header), *self.schema])
+        
+        # Identifies the schema in cached SQL, so changes to it invalidate entries
+        self._schema_fingerprint = bundle.schema_fingerprint
+        
+        # The prompt only varies by the user's question, so the rest is pre-rendered
+        self._prompt_prefix = bundle.prompt_prefix
+        self._prompt_suffix = bundle.prompt_suffix
+        
+        # Request body pieces for run(): everything but the question is encoded
+        # ahead of time, so only the question is serialized per request
+        self._encoded_prompt_prefix = bundle.encoded_prompt_prefix
+        self._encoded_prompt_suffix = bundle.encoded_prompt_suffix
+        self._request_head = b"".join((
+            b'{"model":', json_dumps(self.model_name),
+            b',"stream":true,"keep_alive":', json_dumps(OLLAMA_KEEP_ALIVE),
+            b',"prompt":"'
+        ))
+        self._batch_prompt_prefix = bundle.batch_prompt_prefix
+        self._batch_prompt_suffix = bundle.batch_prompt_suffix
+        
+        # Used to resolve foreign keys in results; lives as long as the engine
+        self._schema_validator = self.db_manager.get_schema_validator(self.engine)
+    
+    @classmethod
+    def clear_schema_cache(cls, engine):
+        """Forget the schema bundle for an engine so the next agent inspects it again"""
+        cls._schema_cache.pop(str(id(engine)), None)
+    
+    def _load_schema_bundle(self):
+        """
+        Introspect the database and pre-render everything derived from its schema
+        
+        Returns:
+            _SchemaBundle for this agent's engine
+        """
+        # Each step builds on the previous one, so the schema is only
+        # introspected once (foreign keys first, they're cached per engine)
+        self.foreign_keys = self.db_manager.get_foreign_keys(self.engine)
+        self.schema = self.db_manager.get_tables_schema(self.engine)
+        self.tables_description = self.db_manager.get_tables_description(self.engine, self.schema)
+        self.join_hints = self.db_manager.generate_join_hints(self.engine)
         self.table_columns = self._build_table_columns_map()
+        prompt_prefix, prompt_suffix, batch_prompt_prefix, batch_prompt_suffix = self._build_prompt_template()
+        referenced_tables = frozenset(
+            fk["referred_table"] for fks in self.foreign_keys.values() for fk in fks
+        )
+        
+        return _SchemaBundle(
+            tables_description=self.tables_description,
+            schema=self.schema,
+            foreign_keys=self.foreign_keys,
+            join_hints=self.join_hints,
+            table_columns=self.table_columns,
+            table_names_ci={table.lower(): table for table in self.schema},
+            referenced_tables=referenced_tables,
+            schema_fingerprint=hashlib.sha1(
+                json.dumps(self.schema, sort_keys=True, default=str).encode()
+            ).hexdigest(),
+            prompt_prefix=prompt_prefix,
+            prompt_suffix=prompt_suffix,
+            encoded_prompt_prefix=_encode_json_string_content(prompt_prefix),
+            encoded_prompt_suffix=_encode_json_string_content(prompt_suffix),
+            batch_prompt_prefix=batch_prompt_prefix,
+            batch_prompt_suffix=batch_prompt_suffix
+        )
     
     def _build_table_columns_map(self):
-        """Build a map of table names to their columns"""
-        table_columns = {}
-        for table_name, table_info in self.schema.items():
-            columns = [col['name'] for col in table_info['columns']]
-            table_columns[table_name] = columns
-        return table_columns
+        """Build a map of table names to a tuple of their column names"""
+        return {
+            table_name: tuple(col['name'] for col in table_info['columns'])
+            for table_name, table_info in self.schema.items()
+        }
     
-    def sql_engine(self, query, return_full_result=False):
+    def sql_engine(self, query, return_full_result=False, format_table=True):
         """
         Execute a SQL query and return the results
         
         Args:
             query: SQL query string
             return_full_result: Whether to return the full result dictionary with enhanced data
+            format_table: Whether to render the rows as a text table in the result
             
         Returns:
             String result or full result dictionary based on return_full_result
         """
-        return self.db_manager.execute_query(self.engine, query, return_full_result)
+        return self.db_manager.execute_query(self.engine, query, return_full_result, format_table)
     
-    def generate_prompt(self, user_query):
+    def _build_prompt_template(self):
         """
-        Generate a prompt for the language model with dynamic join hints
-        and detailed schema validation instructions
+        Render the static parts of the prompt around the user's question
+        
+        Returns:
+            Tuple of (prefix, suffix, batch_prefix, batch_suffix) strings, the
+            batch pair wrapping a numbered list of questions for run_batch()
         """
         # Build a compact representation of available tables and columns
-        table_column_info = ""
-        for table_name, table_info in self.schema.items():
-            columns = [col['name'] for col in table_info['columns']]
-            table_column_info += f"\n- Table '{table_name}' has columns: {', '.join(columns)}"
+        table_column_info = "".join(
+            f"\n- Table '{table_name}' has columns: {', '.join(columns)}"
+            for table_name, columns in self.table_columns.items()
+        )
         
-        return f"""You are a helpful SQL assistant. Your job is to convert a natural language question into a valid SQL query.
-
-Database information:
+        schema_info = f"""Database information:
 {self.tables_description}
 
 Available tables and columns:{table_column_info}
@@ -72,108 +347,169 @@ Available tables and columns:{table_column_info}
 Foreign key relationships:
 {self.join_hints}
 
-User's question: {user_query}
-
-IMPORTANT INSTRUCTIONS:
-1. Think step by step about what SQL query would best answer this question.
-2. ONLY use tables and columns that actually exist in the database schema provided above.
+"""
+        
+        # Instructions shared by single and batched prompts
+        rules = """2. ONLY use tables and columns that actually exist in the database schema provided above.
 3. Double-check all table and column names to ensure they match exactly what's in the schema.
 4. When the query involves multiple tables, use JOIN clauses based on the foreign key relationships provided.
 5. Always use table aliases when joining tables (e.g., 'projects AS p').
 6. Always qualify column names with their table aliases (e.g., 'p.id', not just 'id').
 7. If the request is for data from a table that has foreign keys, automatically join with the related tables.
 8. Use LEFT JOIN instead of INNER JOIN by default to ensure all primary table records are included.
-9. When joining multiple tables, create meaningful aliases like 'p' for 'projects', 'c' for 'categories', etc.
+9. When joining multiple tables, create meaningful aliases like 'p' for 'projects', 'c' for 'categories', etc."""
+        
+        prefix = f"""You are a helpful SQL assistant. Your job is to convert a natural language question into a valid SQL query.
+
+{schema_info}User's question: """
+        
+        suffix = f"""
+
+IMPORTANT INSTRUCTIONS:
+1. Think step by step about what SQL query would best answer this question.
+{rules}
 10. Include a semicolon at the end of your query.
 11. ONLY provide the SQL query itself without any markdown formatting, explanations, or additional text.
 12. Do NOT use triple backticks or markdown formatting.
 
 Now, provide ONLY the SQL query for the user's question above."""
+        
+        batch_prefix = f"""You are a helpful SQL assistant. Your job is to convert each of a numbered list of natural language questions into a valid SQL query.
+
+{schema_info}User's questions:
+"""
+        
+        batch_suffix = f"""
+
+IMPORTANT INSTRUCTIONS:
+1. Think step by step about what SQL query would best answer each question.
+{rules}
+10. End every query with a semicolon.
+11. Respond with ONLY a JSON array of strings containing one SQL query per question, in the same order as the questions.
+12. Do NOT add explanations, markdown formatting or triple backticks.
+
+Now, provide ONLY the JSON array of SQL queries for the user's questions above."""
+        
+        return prefix, suffix, batch_prefix, batch_suffix
+    
+    def _read_completion(self, response):
+        """
+        Collect the generated text from a streamed Ollama response
+        
+        Reading stops as soon as the statement is terminated by a semicolon
+        outside quotes or a closing code fence, since anything after that is discarded anyway.
+        Leaving the stream early lets Ollama stop generating.
+        
+        Args:
+            response: Streaming response from the Ollama generate endpoint
+            
+        Returns:
+            The generated text received so far
+        """
+        parts = []
+        scanner = _StatementEndScanner()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            
+            chunk = json_loads(line)
+            if "error" in chunk:
+                raise RuntimeError(f"Error calling Ollama API: {chunk['error']}")
+            
+            token = chunk.get("response", "")
+            parts.append(token)
+            
+            if chunk.get("done") or scanner.feed(token):
+                break
+        
+        return "".join(parts)
+    
+    def generate_prompt(self, user_query):
+        """
+        Generate a prompt for the language model with dynamic join hints
+        and detailed schema validation instructions
+        """
+        return f"{self._prompt_prefix}{user_query}{self._prompt_suffix}"
+    
+    def _generate_request_body(self, user_query):
+        """
+        Build the JSON body of a streaming generate request for a question
+        
+        Equivalent to serializing the model, generate_prompt(user_query) and the
+        streaming options, but the large static parts of the prompt are spliced
+        in already encoded.
+        """
+        return b"".join((
+            self._request_head,
+            self._encoded_prompt_prefix,
+            _encode_json_string_content(user_query),
+            self._encoded_prompt_suffix,
+            b'"}'
+        ))
+    
+    def generate_batch_prompt(self, user_queries):
+        """
+        Generate one prompt asking for the SQL of several questions, so the
+        schema description is only sent once
+        """
+        questions = "\n".join(f"{i}. {user_query}" for i, user_query in enumerate(user_queries, 1))
+        return f"{self._batch_prompt_prefix}{questions}{self._batch_prompt_suffix}"
     
     def extract_sql_query(self, response):
         """Extract SQL query from model response"""
+        match = _SQL_BLOCK_RE.search(response)
+        sql_part = match.group(1).strip() if match else ""
+        
+        # Fallback: just return the whole response with any markdown removed
+        return sql_part or response.replace("```sql", "").replace("```", "").strip()
+    
+    def extract_sql_queries(self, response, expected_count):
+        """
+        Extract the SQL queries from a response to a batch prompt
+        
+        Args:
+            response: Model response expected to contain a JSON array of strings
+            expected_count: Number of questions in the prompt
+            
+        Returns:
+            List of SQL queries, or None if the response isn't a JSON array with
+            one string per question
+        """
+        start = response.find("[")
+        end = response.rfind("]")
+        if start == -1 or end < start:
+            return None
+        
         try:
-            # Look for SQL query between ```sql and ``` markers
-            if "```sql" in response and "```" in response.split("```sql")[1]:
-                sql_part = response.split("```sql")[1].split("```")[0].strip()
-                return sql_part
-            
-            # Alternative pattern: just between ``` markers
-            elif "```" in response and "```" in response.split("```")[1]:
-                sql_part = response.split("```")[1].split("```")[0].strip()
-                return sql_part
-                
-            # Handle case where response ends with partial ``` markers
-            elif "```sql" in response:
-                sql_part = response.split("```sql")[1].strip()
-                return sql_part
-                
-            # Fallback: just return the whole response with any markdown removed
-            response = response.replace("```sql", "").replace("```", "").strip()
-            return response
-        except Exception:
-            # Remove any markdown formatters as a last resort
-            return response.replace("```sql", "").replace("```", "").strip()
+            sql_queries = json_loads(response[start:end + 1])
+        except ValueError:
+            return None
+        
+        if (not isinstance(sql_queries, list) or len(sql_queries) != expected_count
+                or not all(isinstance(sql_query, str) for sql_query in sql_queries)):
+            return None
+        
+        return [self.extract_sql_query(sql_query) for sql_query in sql_queries]
     
     def _detect_query_type(self, query):
-        """Detect the type of query (SELECT, INSERT, UPDATE, DELETE, etc.)"""
-        query = query.strip().upper()
-        if query.startswith("SELECT"):
-            return "SELECT"
-        elif query.startswith("INSERT"):
-            return "INSERT"
-        elif query.startswith("UPDATE"):
-            return "UPDATE"
-        elif query.startswith("DELETE"):
-            return "DELETE"
-        elif query.startswith("SHOW") or query.startswith("DESCRIBE"):
-            return "SHOW"
-        else:
-            return "OTHER"
+        """
+        Detect the type of query (SELECT, INSERT, UPDATE, DELETE, etc.)
+        
+        Purely keyword-based: only the first few characters are inspected.
+        """
+        head = query.lstrip()[:8].upper()
+        for keyword, query_type in _KIND_MAP:
+            if head.startswith(keyword):
+                return query_type
+        return "OTHER"
     
     def _extract_main_table(self, query):
         """Extract the main table from a SQL query"""
-        # For SELECT queries
-        if "FROM " in query.upper():
-            after_from = query.upper().split("FROM ")[1].strip()
-            # Extract table name (handles cases with WHERE, JOIN, etc.)
-            table_parts = re.split(r'\s+', after_from, 1)
-            table_name = table_parts[0].strip()
-            # Remove any trailing comma or semicolon
-            return table_name.rstrip(',;')
-        
-        # For UPDATE queries
-        elif query.upper().startswith("UPDATE "):
-            after_update = query.upper().split("UPDATE ")[1].strip()
-            # Extract table name (handles cases with SET, WHERE, etc.)
-            table_parts = re.split(r'\s+', after_update, 1)
-            table_name = table_parts[0].strip()
-            # Remove any trailing comma or semicolon
-            return table_name.rstrip(',;')
-        
-        # For INSERT queries
-        elif "INTO " in query.upper():
-            after_into = query.upper().split("INTO ")[1].strip()
-            # Extract table name (handles cases with VALUES, etc.)
-            table_parts = re.split(r'\s+', after_into, 1)
-            table_name = table_parts[0].strip()
-            # Remove any trailing comma, semicolon, or parenthesis
-            return table_name.rstrip(',;(')
-        
-        # For DELETE queries
-        elif "FROM " in query.upper() and query.upper().startswith("DELETE"):
-            after_from = query.upper().split("FROM ")[1].strip()
-            # Extract table name (handles cases with WHERE, etc.)
-            table_parts = re.split(r'\s+', after_from, 1)
-            table_name = table_parts[0].strip()
-            # Remove any trailing comma or semicolon
-            return table_name.rstrip(',;')
-        
-        return None
+        return _find_main_table(query)
     
     def _has_join(self, query):
-        """Check if a query already has JOIN clauses"""
-        return " JOIN " in query.upper()
+        """Check if a query already has JOIN clauses, ignoring string literals and comments"""
+        return any(kind == "word" and text.upper() == "JOIN" for kind, text, _, _, _ in tokenize(query))
     
     def enhance_query_with_joins(self, query):
         """
@@ -184,8 +520,10 @@ Now, provide ONLY the SQL query for the user's question above."""
         if not self.foreign_keys:
             return query
         
-        # Clean the query
-        cleaned_query = query.replace("```sql", "").replace("```", "").strip()
+        # Clean the query (generated SQL is usually fence-free already)
+        if "```" in query:
+            query = query.replace("```sql", "").replace("```", "")
+        cleaned_query = query.strip()
         
         # Detect query type
         query_type = self._detect_query_type(cleaned_query)
@@ -194,53 +532,55 @@ Now, provide ONLY the SQL query for the user's question above."""
         if query_type != "SELECT" or self._has_join(cleaned_query):
             return cleaned_query
         
+        # Only plain "SELECT * FROM table" queries are rewritten: the suggested
+        # query joins related tables in, which would make aliases unknown,
+        # change aggregates and multiply rows for a custom SELECT list, and a
+        # second table reference (comma join, subquery) could capture columns
+        select_parts = analyze_select(cleaned_query)
+        if not select_parts or select_parts["select_list"] != "*":
+            return cleaned_query
+        table_references = extract_table_references(cleaned_query)
+        if len(table_references) != 1 or table_references[0][1]:
+            return cleaned_query
+        
         # Extract the main table
-        main_table = self._extract_main_table(cleaned_query)
-        if not main_table or main_table not in self.schema:
+        main_table = self._resolve_table_name(select_parts["main_table"])
+        if not main_table:
             return cleaned_query
         
-        # Check if the table has foreign keys or is referenced by foreign keys
-        has_fk_relations = main_table in self.foreign_keys or self._is_referenced_by_others(main_table)
-        if not has_fk_relations:
+        # Only tables that point at others through single-column foreign keys
+        # are joined: each row then matches at most one row per joined table.
+        # Joining in tables that point back at this one (or on part of a
+        # composite key) would repeat its rows and make LIMIT count the copies
+        table_fks = self.foreign_keys.get(main_table)
+        if (not table_fks or self._is_referenced_by_others(main_table)
+                or any(len(fk["constrained_columns"]) != 1 for fk in table_fks)):
+            return cleaned_query
+        
+        # Grouping over the joined columns would change the result
+        after_from = select_parts["trailing_clauses"]
+        if after_from and any(
+            kind == "word" and text.upper() in ("GROUP", "HAVING")
+            for kind, text, _, _, _ in tokenize(after_from)
+        ):
             return cleaned_query
         
         # Generate a suggested join query
-        suggested_query = self.db_manager.suggest_join_query(self.engine, main_table)
+        suggested_query = self._suggest_join_query(main_table)
         
         # If we couldn't generate a suggested query, return the original
         if not suggested_query or suggested_query.startswith("Table") or suggested_query.startswith("No foreign key"):
             return cleaned_query
         
-        # Try to preserve WHERE, ORDER BY, LIMIT clauses from the original query
-        # Extract SELECT part from the original query
-        original_select = None
-        if "SELECT " in cleaned_query.upper() and " FROM " in cleaned_query.upper():
-            original_select = cleaned_query.upper().split("SELECT ")[1].split(" FROM ")[0].strip()
-        
-        # Extract clauses after the FROM and table name
-        after_from = None
-        if " FROM " in cleaned_query.upper() and main_table.upper() in cleaned_query.upper():
-            from_parts = cleaned_query.upper().split(" FROM ")[1]
-            after_table_parts = from_parts.split(main_table.upper(), 1)
-            if len(after_table_parts) > 1:
-                after_from = after_table_parts[1].strip()
-        
-        # If the original query has a custom SELECT part, try to preserve it
-        if original_select and original_select != "*" and "SELECT " in suggested_query.upper():
-            suggested_query = suggested_query.replace(suggested_query.split("SELECT ")[1].split(" FROM ")[0].strip(), original_select)
-        
-        # If the original query has clauses after FROM, try to preserve them
-        if after_from and " WHERE " not in suggested_query.upper():
+        # Preserve WHERE, ORDER BY, LIMIT clauses from the original query
+        if after_from and not _WHERE_RE.search(suggested_query):
             # Remove semicolon from suggested query if it exists
             if suggested_query.endswith(";"):
                 suggested_query = suggested_query[:-1]
             
-            # Add the original clauses
-            if after_from.startswith("WHERE") or after_from.startswith("ORDER") or after_from.startswith("LIMIT"):
-                suggested_query += " " + after_from
-            else:
-                # If it doesn't start with a clause keyword, assume it might be a WHERE clause without the keyword
-                suggested_query += " WHERE " + after_from
+            # Add the original clauses; the joined tables may share column
+            # names with the main table, so its columns are qualified
+            suggested_query += " " + self._qualify_columns(after_from, main_table)
             
             # Ensure the query ends with a semicolon
             if not suggested_query.endswith(";"):
@@ -248,13 +588,69 @@ Now, provide ONLY the SQL query for the user's question above."""
         
         return suggested_query
     
+    def _qualify_columns(self, clause, table):
+        """
+        Prefix the unqualified column names of a table in an SQL clause with the table name
+        
+        Args:
+            clause: Clause text from a query that reads only from this table
+            table: Table the columns belong to
+            
+        Returns:
+            The clause with e.g. "id < 3" rewritten as "table.id < 3", and
+            "TABLE.id" spelled as in the schema
+        """
+        columns = {column.lower() for column in self.table_columns.get(table, ())}
+        table_lower = table.lower()
+        parts = []
+        last = 0
+        for kind, text, start, end, _ in tokenize(clause):
+            if kind != "word":
+                continue
+            
+            # The rewritten query names the table as the schema spells it, so
+            # qualifiers written in another case have to follow
+            if text != table and text.lower() == table_lower and clause[end:end + 1] == ".":
+                parts.append(clause[last:start])
+                parts.append(table)
+                last = end
+                continue
+            
+            if text.lower() not in columns:
+                continue
+            
+            # Skip qualified names (x.col), qualifiers (col.x) and function calls
+            if clause[start - 1:start] == "." or clause[end:end + 1] in (".", "("):
+                continue
+            
+            parts.append(clause[last:start])
+            parts.append(f"{table}.{text}")
+            last = end
+        
+        parts.append(clause[last:])
+        return "".join(parts)
+    
+    def _resolve_table_name(self, table):
+        """
+        Match a table name from generated SQL against the schema, ignoring case
+        
+        Args:
+            table: Table name as written in the query, or None
+            
+        Returns:
+            The table's name as spelled in the schema, or None if it isn't there
+        """
+        if not table or table in self.schema:
+            return table or None
+        return self._schema_ci.get(table.lower())
+    
     def _is_referenced_by_others(self, table):
         """Check if a table is referenced by other tables' foreign keys"""
-        for other_table, fks in self.foreign_keys.items():
-            for fk in fks:
-                if fk["referred_table"] == table:
-                    return True
-        return False
+        return table in self._referenced_tables
+    
+    def _suggest_join_query(self, table_name):
+        """Get the suggested JOIN query for a table (cached per engine by the db_manager)"""
+        return self.db_manager.suggest_join_query(self.engine, table_name)
     
     def build_normalized_query(self, table_name, include_related=True):
         """
@@ -272,7 +668,7 @@ Now, provide ONLY the SQL query for the user's question above."""
             return f"SELECT * FROM {table_name};"
             
         # Use the db_manager's suggest_join_query to create a comprehensive JOIN query
-        join_query = self.db_manager.suggest_join_query(self.engine, table_name)
+        join_query = self._suggest_join_query(table_name)
         
         # If the suggested query generation fails, fall back to a simple query
         if not join_query or join_query.startswith("Table") or join_query.startswith("No foreign key"):
@@ -280,148 +676,325 @@ Now, provide ONLY the SQL query for the user's question above."""
             
         return join_query
     
-    def run(self, query, normalize_results=True):
+    def run(self, query, normalize_results=True, use_cache=True):
         """
         Run the agent with a natural language query
         
         Args:
             query: Natural language query from the user
             normalize_results: Whether to normalize results by including related table data
+            use_cache: Whether SQL generated earlier for the same question may be reused;
+                when False the model is always asked and its answer replaces the cached one
                 
         Returns:
             Dictionary with the original query, generated SQL, and results including normalized data
         """
         try:
-            # 1. Generate prompt for Ollama
-            prompt = self.generate_prompt(query)
-            
-            # 2. Call Ollama API
-            response = requests.post(
-                self.ollama_url,
-                json={
-                    "model": self.model_name,
-                    "prompt": prompt,
-                    "stream": False
-                }
-            )
-            
-            if response.status_code != 200:
-                return {
-                    "user_query": query,
-                    "error": f"Error calling Ollama API: {response.text}",
-                    "status_code": response.status_code
-                }
-            
-            # 3. Extract the generated text
-            generated_text = response.json().get("response", "")
-            
-            # 4. Extract SQL query from the response
-            sql_query = self.extract_sql_query(generated_text)
+            # Reuse the SQL generated earlier for the same question
+            sql_query = self._get_cached_sql(query) if use_cache else None
             
-            # 5. Enhance the query with JOINs if needed and applicable
-            enhanced_query = self.enhance_query_with_joins(sql_query)
-            
-            # 6. Execute the query with full result data
-            try:
-                # Get the full result object with enhanced data
-                result_obj = self.sql_engine(enhanced_query, return_full_result=True)
-                
-                # Extract the text result for backward compatibility
-                result = result_obj["result"]
+            if sql_query is None:
+                # 1. Generate the request for Ollama, prompt included
+                body = self._generate_request_body(query)
                 
-                # Extract data and normalized data if available
-                data = result_obj.get("data", [])
-                normalized_data = result_obj.get("normalized_data", [])
-                
-                # If normalization is requested but no normalized data available yet,
-                # extract the main table and get normalized data directly
-                if normalize_results and not normalized_data and data:
-                    main_table = self._extract_main_table(enhanced_query)
-                    if main_table and main_table in self.schema:
-                        # Get the schema validator for this engine
-                        engine_id = str(id(self.engine))
-                        if engine_id in self.db_manager.schema_validators:
-                            schema_validator = self.db_manager.schema_validators[engine_id]
-                            normalized_data = schema_validator.resolve_foreign_keys(data, main_table)
-                        else:
-                            # Try to get normalized data from the db_manager directly
-                            normalized_result = self.db_manager.get_normalized_data(
-                                self.engine, main_table, limit=100
-                            )
-                            if normalized_result and "normalized_data" in normalized_result:
-                                normalized_data = normalized_result["normalized_data"]
-                
-                # 7. Format and return the response with all available data
-                response_data = {
-                    "user_query": query,
-                    "sql_query": enhanced_query,
-                    # "result": result,
-                    "data": data
-                }
-                
-                # Add normalized data if available
-                if normalized_data:
-                    response_data["normalized_data"] = normalized_data
-                
-                # Add debug info if query was enhanced
-                if enhanced_query != sql_query:
-                    response_data["original_query"] = sql_query
-                    response_data["note"] = "The original query was enhanced with JOINs based on foreign key relationships."
-                
-                return response_data
-                
-            except Exception as e:
-                # Extract the main table from the query, if possible
-                main_table = self._extract_main_table(enhanced_query)
-                
-                if main_table and main_table in self.schema:
-                    # Get normalized data for this table
-                    if normalize_results:
-                        normalized_result = self.db_manager.get_normalized_data(
-                            self.engine, main_table, limit=100
-                        )
-                        
-                        # Log the fallback
-                        fallback_note = f"The original query failed: {str(e)}. Using a normalized query instead."
-                        
-                        # Return the normalized data
+                # 2. Call Ollama API, streaming so we can stop once the SQL is complete
+                with self.session.post(
+                    self.ollama_url,
+                    data=body,
+                    headers=_JSON_HEADERS,
+                    stream=True,
+                    timeout=OLLAMA_TIMEOUT
+                ) as response:
+                    if response.status_code != 200:
                         return {
                             "user_query": query,
-                            "sql_query": normalized_result.get("sql_query", ""),
-                            "original_query": enhanced_query,
-                            "result": normalized_result.get("result", ""),
-                            "data": normalized_result.get("data", []),
-                            "normalized_data": normalized_result.get("normalized_data", []),
-                            "note": fallback_note
+                            "error": f"Error calling Ollama API: {response.text}",
+                            "status_code": response.status_code
                         }
-                    else:
-                        # Just use a simple query
-                        simple_query = f"SELECT * FROM {main_table};"
-                        
-                        # Log the fallback
-                        fallback_note = f"The original query failed: {str(e)}. Using a simplified query."
-                        
-                        # Execute the query
-                        result_obj = self.sql_engine(simple_query, return_full_result=True)
-                        
-                        # Return the result
-                        return {
-                            "user_query": query,
-                            "sql_query": simple_query,
-                            "original_query": enhanced_query,
-                            "result": result_obj.get("result", ""),
-                            "data": result_obj.get("data", []),
-                            "normalized_data": result_obj.get("normalized_data", []),
-                            "note": fallback_note
-                        }
-                else:
-                    # If we can't extract a main table, raise the original error
-                    raise
+                    
+                    # 3. Extract the generated text
+                    generated_text = self._read_completion(response)
+                
+                # 4. Extract SQL query from the response
+                sql_query = self.extract_sql_query(generated_text)
+            
+            return self._run_generated_sql(query, sql_query, normalize_results)
                 
         except Exception as e:
-            return {
+            return self._error_response(query, e)
+    
+    def _run_generated_sql(self, query, sql_query, normalize_results):
+        """
+        Enhance, execute and format the SQL generated for a question
+        
+        The SQL is remembered for the question only if it ran as generated;
+        SQL that failed or needed a fallback query is dropped from the cache.
+        
+        Args:
+            query: Natural language query from the user
+            sql_query: SQL extracted from the model's response
+            normalize_results: Whether to normalize results by including related table data
+            
+        Returns:
+            Dictionary with the original query, generated SQL, and results including normalized data
+        """
+        # 5. Enhance the query with JOINs if needed and applicable
+        enhanced_query = self.enhance_query_with_joins(sql_query)
+        
+        # 6. Execute the query with full result data
+        try:
+            # Get the full result object with enhanced data; only the data is
+            # returned, so the text table isn't rendered
+            result_obj = self.sql_engine(enhanced_query, return_full_result=True, format_table=False)
+            
+            # Extract the text result for backward compatibility
+            result = result_obj["result"]
+            
+            # Remember the SQL for this question only if it ran as generated
+            if "fallback_query" in result_obj or any(
+                warning.startswith("Error executing query:") for warning in result_obj.get("warnings", ())
+            ):
+                self._forget_sql(query)
+            else:
+                self._cache_sql(query, sql_query)
+            
+            # Extract data and normalized data if available
+            data = result_obj.get("data", [])
+            normalized_data = result_obj.get("normalized_data", [])
+            
+            # If normalization is requested but no normalized data available yet,
+            # extract the main table and get normalized data directly
+            if normalize_results and not normalized_data and data:
+                main_table = self._resolve_table_name(self._extract_main_table(enhanced_query))
+                if main_table:
+                    normalized_data = self._schema_validator.resolve_foreign_keys(data, main_table)
+            
+            # 7. Format and return the response with all available data
+            response_data = {
                 "user_query": query,
-                "error": f"Error running agent: {str(e)}",
-                "fallback_query": "SHOW TABLES;",
-                "fallback_result": self.sql_engine("SHOW TABLES;")
-            }
\ No newline at end of file
+                "sql_query": enhanced_query,
+                # "result": result,
+                "data": data
+            }
+            
+            # Add normalized data if available
+            if normalized_data:
+                response_data["normalized_data"] = normalized_data
+            
+            # Add debug info if query was enhanced
+            if enhanced_query != sql_query:
+                response_data["original_query"] = sql_query
+                response_data["note"] = "The original query was enhanced with JOINs based on foreign key relationships."
+            
+            return response_data
+            
+        except Exception as e:
+            self._forget_sql(query)
+            
+            # Extract the main table from the query, if possible
+            main_table = self._resolve_table_name(self._extract_main_table(enhanced_query))
+            
+            if main_table:
+                # Get normalized data for this table
+                if normalize_results:
+                    normalized_result = self.db_manager.get_normalized_data(
+                        self.engine, main_table, limit=100
+                    )
+                    
+                    # Log the fallback
+                    fallback_note = f"The original query failed: {str(e)}. Using a normalized query instead."
+                    
+                    # Return the normalized data
+                    return {
+                        "user_query": query,
+                        "sql_query": normalized_result.get("sql_query", ""),
+                        "original_query": enhanced_query,
+                        "result": normalized_result.get("result", ""),
+                        "data": normalized_result.get("data", []),
+                        "normalized_data": normalized_result.get("normalized_data", []),
+                        "note": fallback_note
+                    }
+                else:
+                    # Just use a simple query
+                    simple_query = f"SELECT * FROM {main_table};"
+                    
+                    # Log the fallback
+                    fallback_note = f"The original query failed: {str(e)}. Using a simplified query."
+                    
+                    # Execute the query
+                    result_obj = self.sql_engine(simple_query, return_full_result=True)
+                    
+                    # Return the result
+                    return {
+                        "user_query": query,
+                        "sql_query": simple_query,
+                        "original_query": enhanced_query,
+                        "result": result_obj.get("result", ""),
+                        "data": result_obj.get("data", []),
+                        "normalized_data": result_obj.get("normalized_data", []),
+                        "note": fallback_note
+                    }
+            else:
+                # If we can't extract a main table, raise the original error
+                raise
+    
+    def _sql_cache_key(self, query):
+        """Key for a question in the SQL cache; only spacing is normalized, as values may be case-sensitive"""
+        return (self._schema_fingerprint, self.model_name, " ".join(query.split()))
+    
+    def _get_cached_sql(self, query):
+        """Return the SQL previously generated for a question, or None"""
+        key = self._sql_cache_key(query)
+        with self._sql_cache_lock:
+            sql_query = self._sql_cache.get(key)
+            if sql_query is not None:
+                self._sql_cache.move_to_end(key)
+            return sql_query
+    
+    def _cache_sql(self, query, sql_query):
+        """Remember the SQL generated for a question, evicting the oldest entry when full"""
+        if not sql_query:
+            return
+        
+        key = self._sql_cache_key(query)
+        with self._sql_cache_lock:
+            self._sql_cache[key] = sql_query
+            self._sql_cache.move_to_end(key)
+            if len(self._sql_cache) > SQL_CACHE_SIZE:
+                self._sql_cache.popitem(last=False)
+    
+    def _forget_sql(self, query):
+        """Drop the SQL cached for a question, if any"""
+        with self._sql_cache_lock:
+            self._sql_cache.pop(self._sql_cache_key(query), None)
+    
+    def _error_response(self, query, error):
+        """Build the response returned when a question could not be answered"""
+        return {
+            "user_query": query,
+            "error": f"Error running agent: {str(error)}",
+            "fallback_query": "SHOW TABLES;",
+            "fallback_result": self._tables_listing
+        }
+    
+    def run_batch(self, queries, normalize_results=True, batch_size=BATCH_SIZE, use_cache=True):
+        """
+        Run several natural language queries with one model call per batch
+        
+        The questions share a single prompt, so the schema description is only
+        processed once per batch instead of once per question. If the model's
+        answer can't be matched to the questions, each question in that batch
+        is run on its own instead. Questions with cached SQL skip the model.
+        
+        Args:
+            queries: List of natural language queries
+            normalize_results: Whether to normalize results by including related table data
+            batch_size: Maximum number of questions per prompt
+            use_cache: Whether SQL generated earlier for the same questions may be reused
+            
+        Returns:
+            List of result dictionaries in the same order as queries
+        """
+        results = [None] * len(queries)
+        
+        # (index, SQL) of questions ready to execute; the rest need the model
+        ready = []
+        pending = []
+        for index, query in enumerate(queries):
+            sql_query = self._get_cached_sql(query) if use_cache else None
+            if sql_query is None:
+                pending.append(index)
+            else:
+                ready.append((index, sql_query))
+        
+        for i in range(0, len(pending), batch_size):
+            batch_indexes = pending[i:i + batch_size]
+            batch = [queries[index] for index in batch_indexes]
+            
+            try:
+                response = self.session.post(
+                    self.ollama_url,
+                    data=json_dumps({
+                        "model": self.model_name,
+                        "prompt": self.generate_batch_prompt(batch),
+                        "stream": False,
+                        "keep_alive": OLLAMA_KEEP_ALIVE
+                    }),
+                    headers=_JSON_HEADERS,
+                    timeout=OLLAMA_TIMEOUT
+                )
+                sql_queries = None
+                if response.status_code == 200:
+                    generated_text = json_loads(response.content).get("response", "")
+                    sql_queries = self.extract_sql_queries(generated_text, len(batch))
+            except Exception:
+                sql_queries = None
+            
+            if sql_queries is None:
+                for index in batch_indexes:
+                    results[index] = self.run(
+                        queries[index], normalize_results=normalize_results, use_cache=use_cache
+                    )
+                continue
+            
+            ready.extend(zip(batch_indexes, sql_queries))
+        
+        for index, sql_query in ready:
+            try:
+                results[index] = self._run_generated_sql(queries[index], sql_query, normalize_results)
+            except Exception as e:
+                results[index] = self._error_response(queries[index], e)
+        
+        return results
+    
+    async def arun(self, query, normalize_results=True, use_cache=True):
+        """
+        Awaitable version of run() for use from async code
+        
+        The Ollama call and SQL execution are blocking, so the whole pipeline
+        runs in a thread pool sized to the database connection pool instead of
+        on the event loop itself.
+        
+        Args:
+            query: Natural language query from the user
+            normalize_results: Whether to normalize results by including related table data
+            use_cache: Whether SQL generated earlier for the same question may be reused
+            
+        Returns:
+            Same dictionary as run()
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            partial(self.run, query, normalize_results=normalize_results, use_cache=use_cache)
+        )
+    
+    async def run_many(self, queries, normalize_results=True, max_concurrency=None, use_cache=True):
+        """
+        Run several natural language queries concurrently
+        
+        Each query's Ollama call and SQL execution overlap with the others
+        instead of running back to back. Ollama only generates in parallel up
+        to its OLLAMA_NUM_PARALLEL setting and queues the rest.
+        
+        Args:
+            queries: List of natural language queries
+            normalize_results: Whether to normalize results by including related table data
+            max_concurrency: Maximum number of queries in flight at once (default: all)
+            use_cache: Whether SQL generated earlier for the same questions may be reused
+            
+        Returns:
+            List of result dictionaries in the same order as queries
+        """
+        if not max_concurrency:
+            return await asyncio.gather(
+                *(self.arun(query, normalize_results=normalize_results, use_cache=use_cache) for query in queries)
+            )
+        
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def run_limited(query):
+            async with semaphore:
+                return await self.arun(query, normalize_results=normalize_results, use_cache=use_cache)
+        
+        return await asyncio.gather(*(run_limited(query) for query in queries))
@@ -1,11 +1,14 @@
 from fastapi import FastAPI, HTTPException, Query, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
+import difflib
 import uvicorn
 
 from database.db_manager import DatabaseManager
-from agent.dynamic_agent import DynamicAgent
+from database.sql_parser import extract_tables
+from agent.dynamic_agent import DynamicAgent, OLLAMA_TIMEOUT
 
 # Create FastAPI app
 app = FastAPI(
@@ -40,11 +43,33 @@ class QueryRequest(BaseModel):
     query: str
     model_name: Optional[str] = "llama3"
     auto_join: Optional[bool] = True  # Default to include foreign key data
+    use_cache: Optional[bool] = True  # Reuse SQL generated earlier for the same question
 
 class DirectSQLRequest(BaseModel):
     db_config: DatabaseConfig
     sql_query: str
 
+def _normalize_response(agent, response):
+    """
+    Resolve foreign keys in a response's rows when the agent didn't
+    
+    Args:
+        agent: DynamicAgent that produced the response
+        response: Response dictionary, updated in place
+    """
+    try:
+        # Try to extract the main table from the query
+        if "sql_query" in response:
+            main_table, _ = extract_tables(response["sql_query"])
+            if main_table:
+                schema_validator = db_manager.get_schema_validator(agent.engine)
+                response["normalized_data"] = schema_validator.resolve_foreign_keys(
+                    response["data"], main_table
+                )
+    except Exception:
+        # If normalization fails, just continue without it
+        pass
+
 @app.post("/api/ask")
 async def ask_question(request: QueryRequest):
     """
@@ -52,46 +77,25 @@ async def ask_question(request: QueryRequest):
     with automatic foreign key detection and JOIN enhancement
     """
     try:
-        # Create agent for this database connection
-        agent = DynamicAgent(
+        # Create agent for this database connection (connecting and schema
+        # introspection block, so keep them off the event loop)
+        agent = await run_in_threadpool(
+            DynamicAgent,
             db_manager=db_manager,
             db_config=request.db_config.dict(),
             model_name=request.model_name
         )
         
         # Run the query with normalization
-        response = agent.run(request.query, normalize_results=request.auto_join)
+        response = await agent.arun(
+            request.query, normalize_results=request.auto_join, use_cache=request.use_cache
+        )
         
         # If no normalized data was provided by the agent but we have data,
-        # try to manually normalize it
+        # try to manually normalize it (this queries the database, so it runs
+        # in the thread pool too)
         if "data" in response and response["data"] and "normalized_data" not in response:
-            try:
-                # Try to extract the main table from the query
-                main_table = None
-                if "sql_query" in response:
-                    # Use a simple regex to extract the table name after FROM
-                    import re
-                    from_match = re.search(r'FROM\s+(\w+)', response["sql_query"], re.IGNORECASE)
-                    if from_match:
-                        main_table = from_match.group(1)
-                        
-                        # Get the schema validator for this engine
-                        engine_id = str(id(agent.engine))
-                        if engine_id in db_manager.schema_validators:
-                            schema_validator = db_manager.schema_validators[engine_id]
-                            response["normalized_data"] = schema_validator.resolve_foreign_keys(
-                                response["data"], main_table
-                            )
-                        else:
-                            # Try to get normalized data from the db_manager directly
-                            normalized_result = db_manager.get_normalized_data(
-                                agent.engine, main_table, limit=100
-                            )
-                            if normalized_result and "normalized_data" in normalized_result:
-                                response["normalized_data"] = normalized_result["normalized_data"]
-            except Exception:
-                # If normalization fails, just continue without it
-                pass
+            await run_in_threadpool(_normalize_response, agent, response)
         
         return response
     except ConnectionError as e:
@@ -99,8 +103,10 @@ async def ask_question(request: QueryRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# The endpoints below only make blocking database/HTTP calls, so they're plain
+# functions: FastAPI runs them in its thread pool instead of on the event loop
 @app.post("/api/direct-sql")
-async def execute_direct_sql(request: DirectSQLRequest):
+def execute_direct_sql(request: DirectSQLRequest):
     """
     Execute SQL queries directly on the specified database
     with schema validation and error recovery
@@ -139,24 +145,17 @@ async def execute_direct_sql(request: DirectSQLRequest):
         if "normalized_data" in result_obj:
             response_data["normalized_data"] = result_obj["normalized_data"]
         
+        # Tables the query reads from, found in a single pass over the SQL
+        main_table, tables_in_query = extract_tables(request.sql_query)
+        
         # If no normalized data was provided but we have data, try to manually normalize it
         if "data" in result_obj and result_obj["data"] and "normalized_data" not in result_obj:
             try:
-                # Try to extract the main table from the query
-                import re
-                from_match = re.search(r'FROM\s+(\w+)', request.sql_query, re.IGNORECASE)
-                if from_match:
-                    main_table = from_match.group(1)
-                    
+                if main_table:
                     # Check if this is a valid table
                     if main_table in available_tables:
                         # Get or create schema validator for this engine
-                        engine_id = str(id(engine))
-                        if engine_id not in db_manager.schema_validators:
-                            from database.schema_validator import SchemaValidator
-                            db_manager.schema_validators[engine_id] = SchemaValidator(engine)
-                        
-                        schema_validator = db_manager.schema_validators[engine_id]
+                        schema_validator = db_manager.get_schema_validator(engine)
                         
                         # Resolve foreign keys for the data
                         normalized_data = schema_validator.resolve_foreign_keys(result_obj["data"], main_table)
@@ -171,22 +170,8 @@ async def execute_direct_sql(request: DirectSQLRequest):
             response_data["available_tables"] = available_tables
             response_data["table_columns"] = table_columns
             
-            # Extract referenced tables from the query to help debugging
-            import re
-            tables_in_query = []
-            # Try to extract table names from the FROM clause
-            from_matches = re.findall(r'\bFROM\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', request.sql_query, re.IGNORECASE)
-            if from_matches:
-                for match in from_matches:
-                    tables_in_query.append(match[0])
-            # Try to extract table names from JOIN clauses
-            join_matches = re.findall(r'\bJOIN\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', request.sql_query, re.IGNORECASE)
-            if join_matches:
-                for match in join_matches:
-                    tables_in_query.append(match[0])
-            
-            # Add referenced tables to the response
-            response_data["tables_in_query"] = tables_in_query
+            # Add referenced tables to the response to help debugging
+            response_data["tables_in_query"] = list(tables_in_query)
             
             # Compare with available tables to identify missing tables
             missing_tables = []
@@ -198,17 +183,12 @@ async def execute_direct_sql(request: DirectSQLRequest):
                 
                 # Suggest closest matches for missing tables
                 suggestions = {}
+                lowercase_tables = {table.lower(): table for table in available_tables}
                 for missing in missing_tables:
-                    closest = None
-                    min_distance = float('inf')
-                    for available in available_tables:
-                        # Simple Levenshtein distance calculation
-                        distance = sum(1 for a, b in zip(missing.lower(), available.lower()) if a != b) + abs(len(missing) - len(available))
-                        if distance < min_distance:
-                            min_distance = distance
-                            closest = available
-                    if closest and min_distance <= 3:  # Only suggest if reasonably close
-                        suggestions[missing] = closest
+                    # Only suggest if reasonably close
+                    closest = difflib.get_close_matches(missing.lower(), lowercase_tables, n=1, cutoff=0.6)
+                    if closest:
+                        suggestions[missing] = lowercase_tables[closest[0]]
                 if suggestions:
                     response_data["table_suggestions"] = suggestions
         
@@ -220,7 +200,7 @@ async def execute_direct_sql(request: DirectSQLRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/schema")
-async def get_database_schema(db_config: DatabaseConfig):
+def get_database_schema(db_config: DatabaseConfig):
     """
     Get the schema of the specified database including foreign key relationships
     """
@@ -250,8 +230,30 @@ async def get_database_schema(db_config: DatabaseConfig):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/schema/refresh")
+def refresh_database_schema(db_config: DatabaseConfig):
+    """
+    Discard the cached schema of the specified database and inspect it again
+    """
+    try:
+        # Get connection to the database
+        engine = db_manager.get_connection(db_config.dict())
+        
+        # Drop cached schema details; agents created afterwards pick up the new schema
+        schema = db_manager.refresh_schema(engine)
+        DynamicAgent.clear_schema_cache(engine)
+        
+        return {
+            "refreshed": True,
+            "tables": list(schema.keys())
+        }
+    except ConnectionError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/api/suggest-join")
-async def suggest_join_query(db_config: DatabaseConfig, table_name: str):
+def suggest_join_query(db_config: DatabaseConfig, table_name: str):
     """
     Suggest a JOIN query for the specified table based on foreign key relationships
     """
@@ -272,7 +274,7 @@ async def suggest_join_query(db_config: DatabaseConfig, table_name: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/normalized-data")
-async def get_normalized_table_data(
+def get_normalized_table_data(
     table_name: str,
     limit: int = Query(100, description="Maximum number of rows to return"),
     db_config: DatabaseConfig = Depends()
@@ -294,7 +296,7 @@ async def get_normalized_table_data(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/normalized-data")
-async def post_normalized_table_data(
+def post_normalized_table_data(
     db_config: DatabaseConfig,
     table_name: str,
     limit: int = 100
@@ -316,13 +318,13 @@ async def post_normalized_table_data(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/models")
-async def list_models():
+def list_models():
     """
     List available Ollama models
     """
     try:
-        import requests
-        response = requests.get("http://localhost:11434/api/tags")
+        # Reuse the agent's pooled connection to Ollama
+        response = DynamicAgent.session.get("http://localhost:11434/api/tags", timeout=OLLAMA_TIMEOUT)
         if response.status_code == 200:
             models = response.json().get("models", [])
             return {"models": [model.get("name") for model in models]}
@@ -340,6 +342,7 @@ async def root():
             "/api/ask - Ask questions in natural language with automatic JOIN detection",
             "/api/direct-sql - Execute SQL queries directly",
             "/api/schema - Get database schema with foreign key relationships", 
+            "/api/schema/refresh - Re-read the database schema after it has changed",
             "/api/suggest-join - Get a suggested JOIN query for a specific table",
             "/api/normalized-data - Get fully normalized data for a table with all foreign key references resolved",
             "/api/models - List available Ollama models"
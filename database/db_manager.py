@@ -1,13 +1,25 @@
 from sqlalchemy import create_engine, inspect, text, MetaData, Table
 from urllib.parse import quote_plus
-import json
+import time
 from database.schema_validator import SchemaValidator
 
+# Connection pool settings for server databases (MySQL, PostgreSQL)
+POOL_SIZE = 10
+MAX_OVERFLOW = 20
+POOL_RECYCLE = 1800  # seconds; stays below typical server idle timeouts
+
+# How long a reflected schema is reused before the database is inspected again
+SCHEMA_CACHE_TTL = 300  # seconds
+
 class DatabaseManager:
     def __init__(self):
         self.connections = {}
         self.foreign_keys_cache = {}
+        self.referenced_tables_cache = {}
+        self.join_query_cache = {}
         self.schema_validators = {}
+        self.inspectors = {}
+        self.schema_cache = {}
     
     def get_connection_string(self, db_config):
         """
@@ -54,12 +66,41 @@ class DatabaseManager:
         else:
             raise ValueError(f"Unsupported database type: {db_type}")
     
+    def get_engine_options(self, db_config):
+        """
+        Get the create_engine keyword arguments for a database configuration
+        """
+        db_type = db_config.get("databasetype", "mysql")
+        
+        # SQLite picks its own pool class, which doesn't accept sizing options
+        if db_type == "sqlite":
+            return {}
+        
+        # Reuse pooled connections across requests, checking them before use
+        # so connections dropped by the server are replaced transparently
+        return {
+            "pool_size": POOL_SIZE,
+            "max_overflow": MAX_OVERFLOW,
+            "pool_recycle": POOL_RECYCLE,
+            "pool_pre_ping": True
+        }
+    
     def get_connection(self, db_config):
         """
         Get or create a database connection based on configuration
         """
-        # Generate a unique key for this connection
-        conn_key = json.dumps(db_config, sort_keys=True)
+        # Generate a unique key for this connection from the fields the
+        # connection string is built from. The password is part of it so a
+        # request with wrong credentials never reuses an authenticated engine.
+        conn_key = (
+            db_config.get("databasetype", "mysql"),
+            db_config.get("envirment"),
+            db_config.get("port"),
+            db_config.get("database"),
+            db_config.get("username"),
+            db_config.get("password"),
+            db_config.get("ssl")
+        )
         
         # Return existing connection if available
         if conn_key in self.connections:
@@ -68,7 +109,7 @@ class DatabaseManager:
         # Create new connection
         try:
             conn_string = self.get_connection_string(db_config)
-            engine = create_engine(conn_string)
+            engine = create_engine(conn_string, **self.get_engine_options(db_config))
             
             # Test connection
             with engine.connect() as conn:
@@ -80,6 +121,25 @@ class DatabaseManager:
         except Exception as e:
             raise ConnectionError(f"Failed to connect to database: {str(e)}")
     
+    def get_inspector(self, engine, refresh=False):
+        """
+        Get or create the schema inspector for an engine
+        
+        The inspector caches what it reflects, so sharing it means table names,
+        columns and constraints are only fetched from the database once.
+        
+        Args:
+            engine: SQLAlchemy engine
+            refresh: Discard previously reflected information
+            
+        Returns:
+            Inspector shared by all callers using this engine
+        """
+        engine_id = str(id(engine))
+        if refresh or engine_id not in self.inspectors:
+            self.inspectors[engine_id] = inspect(engine)
+        return self.inspectors[engine_id]
+    
     def get_foreign_keys(self, engine, refresh=False):
         """
         Get all foreign key relationships in the database
@@ -89,39 +149,120 @@ class DatabaseManager:
         if engine_id in self.foreign_keys_cache and not refresh:
             return self.foreign_keys_cache[engine_id]
         
-        foreign_keys = {}
-        inspector = inspect(engine)
+        inspector = self.get_inspector(engine, refresh=refresh)
         
-        # Get list of tables
-        tables = inspector.get_table_names()
+        # MySQL can list every foreign key in one query instead of one per table
+        foreign_keys = None
+        if engine.dialect.name == "mysql":
+            foreign_keys = self._fetch_mysql_foreign_keys(engine)
         
-        for table in tables:
-            # Get foreign key constraints for this table
-            fkeys = inspector.get_foreign_keys(table)
+        if foreign_keys is None:
+            foreign_keys = {}
             
-            if fkeys:
-                foreign_keys[table] = []
+            # Get list of tables
+            tables = inspector.get_table_names()
+            
+            for table in tables:
+                # Get foreign key constraints for this table
+                fkeys = inspector.get_foreign_keys(table)
                 
-                for fkey in fkeys:
-                    foreign_keys[table].append({
-                        'constrained_columns': fkey['constrained_columns'],
-                        'referred_table': fkey['referred_table'],
-                        'referred_columns': fkey['referred_columns']
-                    })
-        
-        # Cache the results
+                if fkeys:
+                    foreign_keys[table] = []
+                    
+                    for fkey in fkeys:
+                        foreign_keys[table].append({
+                            'constrained_columns': fkey['constrained_columns'],
+                            'referred_table': fkey['referred_table'],
+                            'referred_columns': fkey['referred_columns']
+                        })
+        
+        # Cache the results, along with the set of tables other tables refer to.
+        # JOIN queries suggested from the previous foreign keys are now stale.
         self.foreign_keys_cache[engine_id] = foreign_keys
+        self.join_query_cache.pop(engine_id, None)
+        self.referenced_tables_cache[engine_id] = {
+            fk['referred_table'] for fks in foreign_keys.values() for fk in fks
+        }
         return foreign_keys
     
-    def get_tables_schema(self, engine):
+    def _fetch_mysql_foreign_keys(self, engine):
+        """
+        Read all foreign keys of a MySQL database from information_schema at once
+        
+        Args:
+            engine: SQLAlchemy engine connected to a MySQL database
+            
+        Returns:
+            Foreign keys in the same format as get_foreign_keys(), or None if
+            information_schema couldn't be queried
+        """
+        query = text("""
+            SELECT table_name, constraint_name, column_name,
+                   referenced_table_name, referenced_column_name
+            FROM information_schema.key_column_usage
+            WHERE table_schema = DATABASE() AND referenced_table_name IS NOT NULL
+            ORDER BY table_name, constraint_name, ordinal_position
+        """)
+        
+        try:
+            with engine.connect() as conn:
+                rows = conn.execute(query).fetchall()
+        except Exception:
+            return None
+        
+        # Multi-column constraints span several rows, one per column
+        foreign_keys = {}
+        constraints = {}
+        for table, constraint, column, referred_table, referred_column in rows:
+            fkey = constraints.get((table, constraint))
+            if fkey is None:
+                fkey = {
+                    'constrained_columns': [],
+                    'referred_table': referred_table,
+                    'referred_columns': []
+                }
+                constraints[(table, constraint)] = fkey
+                foreign_keys.setdefault(table, []).append(fkey)
+            
+            fkey['constrained_columns'].append(column)
+            fkey['referred_columns'].append(referred_column)
+        
+        return foreign_keys
+    
+    def get_referenced_tables(self, engine):
+        """
+        Get the set of tables referenced by other tables' foreign keys
+        """
+        engine_id = str(id(engine))
+        if engine_id not in self.referenced_tables_cache:
+            self.get_foreign_keys(engine)
+        return self.referenced_tables_cache[engine_id]
+    
+    def get_tables_schema(self, engine, refresh=False):
         """
         Get schema information for all tables in the database
+        
+        The result is cached per engine for SCHEMA_CACHE_TTL seconds. Once it
+        expires everything derived from the old schema is discarded, and a new
+        dictionary is returned, so callers can tell by identity that it changed.
         """
+        engine_id = str(id(engine))
+        cached = self.schema_cache.get(engine_id)
+        if cached and not refresh and time.monotonic() - cached[0] < SCHEMA_CACHE_TTL:
+            return cached[1]
+        
         schema_info = {}
-        inspector = inspect(engine)
+        
+        # An expired schema is reflected again from scratch: the inspector's
+        # own cache and the foreign keys are refreshed, and the validator
+        # built from the old tables is dropped
+        reload = refresh or cached is not None
+        if reload:
+            self.schema_validators.pop(engine_id, None)
         
         # Get foreign key relationships
-        foreign_keys = self.get_foreign_keys(engine)
+        foreign_keys = self.get_foreign_keys(engine, refresh=reload)
+        inspector = self.get_inspector(engine)
         
         # Get list of tables
         tables = inspector.get_table_names()
@@ -148,19 +289,40 @@ class DatabaseManager:
                 "foreign_keys": fks
             }
         
+        self.schema_cache[engine_id] = (time.monotonic(), schema_info)
         return schema_info
     
-    def get_tables_description(self, engine):
-        """Generate a description of all tables in the database for the agent"""
-        description = "Allows you to perform SQL queries on the tables. Returns a string representation of the result.\nIt can use the following tables:"
+    def refresh_schema(self, engine):
+        """
+        Discard everything cached about an engine's schema and inspect it again
+        
+        Args:
+            engine: SQLAlchemy engine
+            
+        Returns:
+            The freshly reflected schema, as returned by get_tables_schema()
+        """
+        return self.get_tables_schema(engine, refresh=True)
+    
+    def get_tables_description(self, engine, schema_info=None):
+        """
+        Generate a description of all tables in the database for the agent
+        
+        Args:
+            engine: SQLAlchemy engine
+            schema_info: Result of get_tables_schema() if the caller already has it,
+                to avoid introspecting the database again
+        """
+        parts = ["Allows you to perform SQL queries on the tables. Returns a string representation of the result.\nIt can use the following tables:"]
 
         # Get schema info with foreign keys
-        schema_info = self.get_tables_schema(engine)
+        if schema_info is None:
+            schema_info = self.get_tables_schema(engine)
         
         for table_name, table_info in schema_info.items():
             columns_info = [(col["name"], col["type"]) for col in table_info["columns"]]
             
-            table_description = f"\n\nTable '{table_name}':\nColumns:"
+            parts.append(f"\n\nTable '{table_name}':\nColumns:")
             for name, col_type in columns_info:
                 # Mark primary keys
                 is_pk = name in table_info["primary_keys"]
@@ -177,12 +339,10 @@ class DatabaseManager:
                         fk_reference = f" (Foreign Key to {ref_table}.{ref_col})"
                         break
                 
-                table_description += f"\n  - {name}: {col_type}{pk_indicator}{fk_reference}"
-            
-            description += table_description
+                parts.append(f"\n  - {name}: {col_type}{pk_indicator}{fk_reference}")
         
         # Add relationships section
-        description += "\n\nRelationships between tables:"
+        parts.append("\n\nRelationships between tables:")
         relationship_found = False
         
         for table_name, table_info in schema_info.items():
@@ -192,12 +352,12 @@ class DatabaseManager:
                 referred_table = fk["referred_table"]
                 referred_col = fk["referred_columns"][0]  # Simplify for first column
                 
-                description += f"\n  - {table_name}.{constrained_col} references {referred_table}.{referred_col}"
+                parts.append(f"\n  - {table_name}.{constrained_col} references {referred_table}.{referred_col}")
         
         if not relationship_found:
-            description += "\n  No foreign key relationships detected."
+            parts.append("\n  No foreign key relationships detected.")
         
-        return description
+        return "".join(parts)
     
     def generate_join_hints(self, engine):
         """Generate hints for join queries based on detected foreign keys"""
@@ -206,7 +366,7 @@ class DatabaseManager:
         if not foreign_keys:
             return "No foreign key relationships detected in the schema."
             
-        hints = "When creating JOIN queries, consider these relationships:"
+        hints = ["When creating JOIN queries, consider these relationships:"]
         
         for table, fks in foreign_keys.items():
             for fk in fks:
@@ -214,11 +374,26 @@ class DatabaseManager:
                 referred_table = fk["referred_table"]
                 referred_col = fk["referred_columns"][0]  # Simplify for first column
                 
-                hints += f"\n- JOIN {referred_table} ON {table}.{constrained_col} = {referred_table}.{referred_col}"
+                hints.append(f"- JOIN {referred_table} ON {table}.{constrained_col} = {referred_table}.{referred_col}")
         
-        return hints
+        return "\n".join(hints)
     
     def suggest_join_query(self, engine, main_table):
+        """
+        Get a suggested JOIN query for a table with its related tables
+        
+        The query only depends on the schema, so it is generated once per
+        engine and table and served from cache afterwards.
+        """
+        engine_id = str(id(engine))
+        if main_table not in self.join_query_cache.get(engine_id, {}):
+            # Building may load the foreign keys, which resets this engine's cache,
+            # so only look up the engine's entry afterwards
+            join_query = self._build_join_query(engine, main_table)
+            self.join_query_cache.setdefault(engine_id, {})[main_table] = join_query
+        return self.join_query_cache[engine_id][main_table]
+    
+    def _build_join_query(self, engine, main_table):
         """Generate a suggested JOIN query for a table with its related tables"""
         schema_info = self.get_tables_schema(engine)
         foreign_keys = self.get_foreign_keys(engine)
@@ -226,7 +401,7 @@ class DatabaseManager:
         if main_table not in schema_info:
             return f"Table '{main_table}' not found in the schema."
             
-        if main_table not in foreign_keys and not self._is_referenced_by_others(main_table, foreign_keys):
+        if main_table not in foreign_keys and main_table not in self.get_referenced_tables(engine):
             return f"No foreign key relationships found for table '{main_table}'."
             
         # Generate a query that joins the main table with all related tables
@@ -297,15 +472,22 @@ class DatabaseManager:
         
         return query + ";"
     
-    def _is_referenced_by_others(self, table, foreign_keys):
-        """Check if a table is referenced by other tables' foreign keys"""
-        for other_table, fks in foreign_keys.items():
-            for fk in fks:
-                if fk["referred_table"] == table:
-                    return True
-        return False
+    def get_schema_validator(self, engine):
+        """
+        Get or create the schema validator for an engine
+        
+        Args:
+            engine: SQLAlchemy engine
+            
+        Returns:
+            SchemaValidator shared by all callers using this engine
+        """
+        engine_id = str(id(engine))
+        if engine_id not in self.schema_validators:
+            self.schema_validators[engine_id] = SchemaValidator(engine, self.get_inspector(engine))
+        return self.schema_validators[engine_id]
     
-    def execute_query(self, engine, query, return_full_result=False):
+    def execute_query(self, engine, query, return_full_result=False, format_table=True):
         """
         Execute a SQL query and return the results.
         Uses SchemaValidator to validate and adapt the query to the actual database schema.
@@ -315,25 +497,20 @@ class DatabaseManager:
             query: SQL query string
             return_full_result: If True, returns the full result dictionary with enhanced data
                                If False, returns only the text output (default behavior)
+            format_table: Whether to render the rows as a text table in the result;
+                          skip it when only the data is used
         
         Returns:
             String result or full result dictionary based on return_full_result
         """
-        # Get or create schema validator for this engine
-        engine_id = str(id(engine))
-        if engine_id not in self.schema_validators:
-            self.schema_validators[engine_id] = SchemaValidator(engine)
-        
-        schema_validator = self.schema_validators[engine_id]
+        schema_validator = self.get_schema_validator(engine)
         
         # Validate, adapt, and execute the query
-        result_dict, warnings = schema_validator.execute_query_safely(query)
+        result_dict, warnings = schema_validator.execute_query_safely(query, format_table)
         
         # Include warnings in the output
         if warnings:
-            warning_output = "\n\nWarnings/Suggestions:"
-            for warning in warnings:
-                warning_output += f"\n- {warning}"
+            warning_output = "\n\nWarnings/Suggestions:" + "".join(f"\n- {warning}" for warning in warnings)
             result_dict["result"] += warning_output
         
         # Return the full result dictionary if requested
@@ -356,12 +533,7 @@ class DatabaseManager:
         Returns:
             Dictionary with the original query, normalized data, and text results
         """
-        # Get or create schema validator for this engine
-        engine_id = str(id(engine))
-        if engine_id not in self.schema_validators:
-            self.schema_validators[engine_id] = SchemaValidator(engine)
-        
-        schema_validator = self.schema_validators[engine_id]
+        schema_validator = self.get_schema_validator(engine)
         
         # Create a join query if the table has foreign keys
         join_query = self.suggest_join_query(engine, table_name)
@@ -381,9 +553,7 @@ class DatabaseManager:
             
             # Include warnings in the output
             if warnings:
-                warning_output = "\n\nWarnings/Suggestions:"
-                for warning in warnings:
-                    warning_output += f"\n- {warning}"
+                warning_output = "\n\nWarnings/Suggestions:" + "".join(f"\n- {warning}" for warning in warnings)
                 result_dict["result"] += warning_output
             
             # If normalized data is not available but data is present, resolve foreign keys
@@ -406,9 +576,7 @@ class DatabaseManager:
             
             # Include warnings in the output
             if warnings:
-                warning_output = "\n\nWarnings/Suggestions:"
-                for warning in warnings:
-                    warning_output += f"\n- {warning}"
+                warning_output = "\n\nWarnings/Suggestions:" + "".join(f"\n- {warning}" for warning in warnings)
                 result_dict["result"] += warning_output
             
             # If normalized data is not available but data is present, resolve foreign keys
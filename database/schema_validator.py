@@ -1,23 +1,79 @@
-from sqlalchemy import inspect, text
+from sqlalchemy import bindparam, inspect, text
 import re
+from functools import lru_cache
 from typing import Dict, List, Any, Tuple, Optional
 
+from database.sql_parser import extract_table_references, split_clauses
+
+# Column references in a SELECT list or WHERE clause
+_QUALIFIED_COLUMN_RE = re.compile(r'(\w+)\.(\w+)')
+_UNQUALIFIED_COLUMN_RE = re.compile(r'SELECT\s+(?:.*,\s*)?(\w+)(?:\s*,|\s|$)', re.IGNORECASE)
+
+# Target table of data modification statements
+_INSERT_TABLE_RE = re.compile(r'INSERT\s+INTO\s+(\w+)', re.IGNORECASE)
+_UPDATE_TABLE_RE = re.compile(r'UPDATE\s+(\w+)', re.IGNORECASE)
+_DELETE_TABLE_RE = re.compile(r'DELETE\s+FROM\s+(\w+)', re.IGNORECASE)
+
+_VALUES_RE = re.compile(r'\bVALUES\b', re.IGNORECASE)
+_FROM_KEYWORD_RE = re.compile(r'FROM ', re.IGNORECASE)
+
+# Assignments of an UPDATE statement, up to WHERE or the end of the statement
+_SET_CLAUSE_RE = re.compile(r'\bSET\s+(.*?)(?=\s+WHERE\b|\s*;?\s*$)', re.IGNORECASE | re.DOTALL)
+
+# Database error messages (lowercased) naming a missing column or table
+_UNKNOWN_COLUMN_RES = (
+    re.compile(r"unknown column '([^']+)'"),
+    re.compile(r"no such column[:]? ([^\s]+)"),
+    re.compile(r"column '([^']+)' not found")
+)
+_MISSING_TABLE_RE = re.compile(r"table ['\"]?([^'\"\s]+)['\"]?(?:\S+)? (?:not found|doesn't exist)")
+
+# MySQL error messages as reported, used when building a fallback query
+_UNKNOWN_COLUMN_ERROR_RE = re.compile(r"Unknown column '([^']+)'")
+_UNKNOWN_TABLE_ERROR_RE = re.compile(r"Table '([^']+)' doesn't exist")
+
+@lru_cache(maxsize=256)
+def _table_names_pattern(table_names: Tuple[str, ...]):
+    """
+    Compile a pattern matching any of the given table names, but not as the
+    qualifier of a column reference (name.column)
+    
+    The same misspellings come back query after query, so the compiled
+    pattern is memoized on the set of names being replaced.
+    """
+    return re.compile(
+        r'\b(' + '|'.join(map(re.escape, table_names)) + r')\b(?!\s*\.\s*\w+)'
+    )
+
 class SchemaValidator:
     """
     A utility class to validate and adapt SQL queries to match the actual database schema
     with enhanced foreign key resolution
     """
-    def __init__(self, engine):
+    def __init__(self, engine, inspector=None):
         """
         Initialize the schema validator with a database engine
         
         Args:
             engine: SQLAlchemy engine connected to the database
+            inspector: Inspector for the engine to reuse already reflected information
         """
         self.engine = engine
-        self.inspector = inspect(engine)
+        self.inspector = inspector if inspector is not None else inspect(engine)
         self.tables_info = self._get_tables_info()
         self.foreign_key_map = self._build_foreign_key_map()
+        self.column_tables = self._build_column_index()
+        
+        # Lowercased table names mapped to the actual names, for case-insensitive
+        # and plural/singular lookups
+        self.lowercase_table_names = {}
+        for table_name in self.tables_info:
+            self.lowercase_table_names.setdefault(table_name.lower(), table_name)
+        
+        # Resolved table/column names; the schema is fixed for the validator's
+        # lifetime, so each fuzzy lookup only has to be done once
+        self._table_name_matches = {}
+        self._column_name_matches = {}
         
     def _get_tables_info(self) -> Dict[str, Dict[str, Any]]:
         """
@@ -65,6 +121,19 @@ class SchemaValidator:
                     }
         return fk_map
     
+    def _build_column_index(self) -> Dict[str, List[str]]:
+        """
+        Build an inverted index of column names to the tables that have them
+        
+        Returns:
+            Dictionary mapping lowercased column names to table names
+        """
+        column_tables = {}
+        for table_name, table_info in self.tables_info.items():
+            for column_name in table_info['columns']:
+                column_tables.setdefault(column_name.lower(), []).append(table_name)
+        return column_tables
+    
     def get_actual_table_name(self, table_name: str) -> Optional[str]:
         """
         Find the actual table name that most closely matches the provided name
@@ -78,28 +147,43 @@ class SchemaValidator:
         # Direct match
         if table_name in self.tables_info:
             return table_name
+        
+        if table_name not in self._table_name_matches:
+            self._table_name_matches[table_name] = self._find_closest_table_name(table_name)
+        return self._table_name_matches[table_name]
+    
+    def _find_closest_table_name(self, table_name: str) -> Optional[str]:
+        """
+        Match a table name that isn't in the schema as written
+        
+        Args:
+            table_name: The table name to find a match for
             
+        Returns:
+            The closest actual table name, or None if nothing is close enough
+        """
+        table_name_lower = table_name.lower()
+        
         # Case-insensitive match
-        for actual_table in self.tables_info.keys():
-            if actual_table.lower() == table_name.lower():
-                return actual_table
+        if table_name_lower in self.lowercase_table_names:
+            return self.lowercase_table_names[table_name_lower]
                 
         # Check for plural/singular forms
-        if table_name.endswith('s'):
-            singular = table_name[:-1]
-            if singular in self.tables_info:
-                return singular
+        if table_name_lower.endswith('s'):
+            singular = table_name_lower[:-1]
+            if singular in self.lowercase_table_names:
+                return self.lowercase_table_names[singular]
         else:
-            plural = f"{table_name}s"
-            if plural in self.tables_info:
-                return plural
+            plural = f"{table_name_lower}s"
+            if plural in self.lowercase_table_names:
+                return self.lowercase_table_names[plural]
                 
         # Use Levenshtein distance for approximate matching
         min_distance = float('inf')
         closest_match = None
         
         for actual_table in self.tables_info.keys():
-            distance = self._levenshtein_distance(table_name.lower(), actual_table.lower())
+            distance = self._levenshtein_distance(table_name_lower, actual_table.lower())
             if distance < min_distance:
                 min_distance = distance
                 closest_match = actual_table
@@ -127,10 +211,28 @@ class SchemaValidator:
         # Direct match
         if column_name in self.tables_info[table_name]['columns']:
             return column_name
+        
+        key = (table_name, column_name)
+        if key not in self._column_name_matches:
+            self._column_name_matches[key] = self._find_closest_column_name(table_name, column_name)
+        return self._column_name_matches[key]
+    
+    def _find_closest_column_name(self, table_name: str, column_name: str) -> Optional[str]:
+        """
+        Match a column name that isn't in the table as written
+        
+        Args:
+            table_name: The actual table name the column belongs to
+            column_name: The column name to find a match for
             
+        Returns:
+            The closest actual column name, or None if nothing is close enough
+        """
+        column_name_lower = column_name.lower()
+        
         # Case-insensitive match
         for actual_column in self.tables_info[table_name]['columns'].keys():
-            if actual_column.lower() == column_name.lower():
+            if actual_column.lower() == column_name_lower:
                 return actual_column
                 
         # Use Levenshtein distance for approximate matching
@@ -138,7 +240,7 @@ class SchemaValidator:
         closest_match = None
         
         for actual_column in self.tables_info[table_name]['columns'].keys():
-            distance = self._levenshtein_distance(column_name.lower(), actual_column.lower())
+            distance = self._levenshtein_distance(column_name_lower, actual_column.lower())
             if distance < min_distance:
                 min_distance = distance
                 closest_match = actual_column
@@ -208,23 +310,19 @@ class SchemaValidator:
         """
         Detect the type of SQL query
         
+        Detection is purely keyword-based: only the leading keyword is looked
+        at, so the rest of the query is never copied or uppercased.
+        
         Args:
             query: The SQL query
             
         Returns:
             The query type (SELECT, INSERT, UPDATE, DELETE, or OTHER)
         """
-        query_upper = query.strip().upper()
-        if query_upper.startswith("SELECT"):
-            return "SELECT"
-        elif query_upper.startswith("INSERT"):
-            return "INSERT"
-        elif query_upper.startswith("UPDATE"):
-            return "UPDATE"
-        elif query_upper.startswith("DELETE"):
-            return "DELETE"
-        else:
-            return "OTHER"
+        head = query.lstrip()[:6].upper()
+        if head in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+            return head
+        return "OTHER"
     
     def _adapt_select_query(self, query: str, warnings: List[str]) -> Tuple[str, List[str]]:
         """
@@ -237,17 +335,15 @@ class SchemaValidator:
         Returns:
             Tuple of (adapted_query, warning_messages)
         """
-        # Extract table references from FROM clause
-        table_matches = re.findall(r'FROM\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', query, re.IGNORECASE)
-        
-        # Also handle JOIN clauses
-        join_matches = re.findall(r'JOIN\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', query, re.IGNORECASE)
-        
-        table_matches.extend(join_matches)
+        # Extract table references from FROM and JOIN clauses
+        table_matches = extract_table_references(query)
         
         # Dictionary to map table aliases to their actual names
         table_alias_map = {}
         
+        # Misspelled table names mapped to their actual names
+        table_replacements = {}
+        
         # Process table references
         for match in table_matches:
             table_name = match[0]
@@ -256,82 +352,99 @@ class SchemaValidator:
             actual_table = self.get_actual_table_name(table_name)
             
             if actual_table and actual_table != table_name:
-                query = re.sub(r'\b' + re.escape(table_name) + r'\b(?!\s*\.\s*\w+)', actual_table, query)
-                warnings.append(f"Table '{table_name}' was replaced with '{actual_table}'")
+                if table_name not in table_replacements:
+                    table_replacements[table_name] = actual_table
+                    warnings.append(f"Table '{table_name}' was replaced with '{actual_table}'")
             elif not actual_table:
                 warnings.append(f"Warning: Table '{table_name}' not found in database")
             
             # Store the table alias mapping (using actual table name if found)
             table_alias_map[alias] = actual_table if actual_table else table_name
         
+        # Replace all misspelled table names in one pass, leaving qualified
+        # column references (name.column) alone
+        if table_replacements:
+            table_names_re = _table_names_pattern(tuple(table_replacements))
+            query = table_names_re.sub(lambda m: table_replacements[m.group(1)], query)
+        
+        # Corrected column names keyed by lowercased (alias, column), collected
+        # from the SELECT and WHERE clauses and applied in a single pass
+        column_replacements = {}
+        
         # Extract column references from SELECT clause
-        if "SELECT " in query.upper() and " FROM " in query.upper():
-            select_clause = query.upper().split("SELECT ")[1].split(" FROM ")[0].strip()
-            
+        clauses = split_clauses(query)
+        select_clause = clauses["select"]
+        if select_clause and clauses["from"]:
             if select_clause != "*":
                 # Handle column references
-                column_matches = re.findall(r'(\w+)\.(\w+)', select_clause, re.IGNORECASE)
-                
-                for match in column_matches:
-                    alias = match[0]
-                    column_name = match[1]
-                    
-                    if alias in table_alias_map:
-                        table_name = table_alias_map[alias]
-                        
-                        if table_name in self.tables_info:
-                            actual_column = self.get_actual_column_name(table_name, column_name)
-                            
-                            if actual_column and actual_column != column_name:
-                                pattern = r'\b' + re.escape(alias) + r'\.' + re.escape(column_name) + r'\b'
-                                replacement = f"{alias}.{actual_column}"
-                                query = re.sub(pattern, replacement, query, flags=re.IGNORECASE)
-                                warnings.append(f"Column '{alias}.{column_name}' was replaced with '{alias}.{actual_column}'")
-                            elif not actual_column:
-                                warnings.append(f"Warning: Column '{column_name}' not found in table '{table_name}'")
+                self._collect_column_replacements(
+                    select_clause, table_alias_map, column_replacements, warnings, ""
+                )
                 
                 # Also handle unqualified column references
-                unqualified_columns = re.findall(r'SELECT\s+(?:.*,\s*)?(\w+)(?:\s*,|\s|$)', query, re.IGNORECASE)
+                unqualified_columns = _UNQUALIFIED_COLUMN_RE.findall(query)
                 
                 for column_name in unqualified_columns:
                     if column_name.lower() not in ['distinct', 'as', 'count', 'sum', 'avg', 'min', 'max']:
-                        # Try to find this column in any of the tables
-                        found = False
-                        for alias, table in table_alias_map.items():
-                            if table in self.tables_info and self.get_actual_column_name(table, column_name):
-                                found = True
-                                break
+                        # Try to find this column in any of the tables, checking
+                        # exact (case-insensitive) names before fuzzy matching
+                        candidate_tables = self.column_tables.get(column_name.lower(), ())
+                        found = any(table in candidate_tables for table in table_alias_map.values())
+                        if not found:
+                            for alias, table in table_alias_map.items():
+                                if table in self.tables_info and self.get_actual_column_name(table, column_name):
+                                    found = True
+                                    break
                         
                         if not found:
                             warnings.append(f"Warning: Unqualified column '{column_name}' not found in any referenced table")
         
         # Handle WHERE clauses for column references
-        if " WHERE " in query.upper():
-            where_clause = query.upper().split(" WHERE ")[1].split(" GROUP BY ")[0].split(" ORDER BY ")[0].split(" LIMIT ")[0].strip()
-            
-            # Extract column references from WHERE clause
-            column_matches = re.findall(r'(\w+)\.(\w+)', where_clause, re.IGNORECASE)
+        if clauses["where"]:
+            self._collect_column_replacements(
+                clauses["where"], table_alias_map, column_replacements, warnings, " in WHERE clause"
+            )
+        
+        if any(column_replacements.values()):
+            def replace_column(match):
+                actual_column = column_replacements.get((match.group(1).lower(), match.group(2).lower()))
+                return f"{match.group(1)}.{actual_column}" if actual_column else match.group(0)
             
-            for match in column_matches:
-                alias = match[0]
-                column_name = match[1]
-                
-                if alias in table_alias_map:
-                    table_name = table_alias_map[alias]
-                    
-                    if table_name in self.tables_info:
-                        actual_column = self.get_actual_column_name(table_name, column_name)
-                        
-                        if actual_column and actual_column != column_name:
-                            pattern = r'\b' + re.escape(alias) + r'\.' + re.escape(column_name) + r'\b'
-                            replacement = f"{alias}.{actual_column}"
-                            query = re.sub(pattern, replacement, query, flags=re.IGNORECASE)
-                            warnings.append(f"Column '{alias}.{column_name}' in WHERE clause was replaced with '{alias}.{actual_column}'")
-                        elif not actual_column:
-                            warnings.append(f"Warning: Column '{column_name}' in WHERE clause not found in table '{table_name}'")
+            query = _QUALIFIED_COLUMN_RE.sub(replace_column, query)
         
         return query, warnings
     
+    def _collect_column_replacements(self, clause: str, table_alias_map: Dict[str, str],
+                                     column_replacements: Dict[Tuple[str, str], Optional[str]],
+                                     warnings: List[str], location: str) -> None:
+        """
+        Find qualified column references in a clause that need correcting
+        
+        Args:
+            clause: Body of the clause to scan
+            table_alias_map: Dictionary mapping table aliases to actual table names
+            column_replacements: Dictionary to record corrections in; references
+                that need no change are recorded as None so they are only checked once
+            warnings: List to append warning messages to
+            location: Text describing the clause for warning messages
+        """
+        for alias, column_name in _QUALIFIED_COLUMN_RE.findall(clause):
+            key = (alias.lower(), column_name.lower())
+            if key in column_replacements or alias not in table_alias_map:
+                continue
+            
+            table_name = table_alias_map[alias]
+            if table_name not in self.tables_info:
+                continue
+            
+            actual_column = self.get_actual_column_name(table_name, column_name)
+            column_replacements[key] = actual_column if actual_column != column_name else None
+            
+            if actual_column and actual_column != column_name:
+                warnings.append(f"Column '{alias}.{column_name}'{location} was replaced with '{alias}.{actual_column}'")
+            elif not actual_column:
+                warnings.append(f"Warning: Column '{column_name}'{location} not found in table '{table_name}'")
+    
     def _adapt_data_modification_query(self, query: str, query_type: str, warnings: List[str]) -> Tuple[str, List[str]]:
         """
         Adapt an INSERT, UPDATE, or DELETE query to match the actual database schema
@@ -346,41 +459,40 @@ class SchemaValidator:
         """
         if query_type == "INSERT":
             # Extract table name from INSERT INTO clause
-            table_matches = re.findall(r'INSERT\s+INTO\s+(\w+)', query, re.IGNORECASE)
+            table_match = _INSERT_TABLE_RE.search(query)
         elif query_type == "UPDATE":
             # Extract table name from UPDATE clause
-            table_matches = re.findall(r'UPDATE\s+(\w+)', query, re.IGNORECASE)
+            table_match = _UPDATE_TABLE_RE.search(query)
         elif query_type == "DELETE":
             # Extract table name from DELETE FROM clause
-            table_matches = re.findall(r'DELETE\s+FROM\s+(\w+)', query, re.IGNORECASE)
+            table_match = _DELETE_TABLE_RE.search(query)
         else:
             return query, warnings
         
-        if table_matches:
-            table_name = table_matches[0]
+        if table_match:
+            table_name = table_match.group(1)
             actual_table = self.get_actual_table_name(table_name)
             
             if actual_table and actual_table != table_name:
-                # Replace table name in the query
-                if query_type == "INSERT":
-                    query = re.sub(r'INSERT\s+INTO\s+' + re.escape(table_name), f"INSERT INTO {actual_table}", query, flags=re.IGNORECASE)
-                elif query_type == "UPDATE":
-                    query = re.sub(r'UPDATE\s+' + re.escape(table_name), f"UPDATE {actual_table}", query, flags=re.IGNORECASE)
-                elif query_type == "DELETE":
-                    query = re.sub(r'DELETE\s+FROM\s+' + re.escape(table_name), f"DELETE FROM {actual_table}", query, flags=re.IGNORECASE)
+                # Replace table name in the query, where the pattern found it
+                query = f"{query[:table_match.start(1)]}{actual_table}{query[table_match.end(1):]}"
                 
                 warnings.append(f"Table '{table_name}' was replaced with '{actual_table}'")
             elif not actual_table:
                 warnings.append(f"Warning: Table '{table_name}' not found in database")
         
         # Handle column references in INSERT queries
-        if query_type == "INSERT" and "(" in query and ")" in query and "VALUES" in query.upper():
+        # The column list is the parenthesized group before VALUES, if there is one
+        values_match = _VALUES_RE.search(query) if query_type == "INSERT" else None
+        columns_start = query.find("(", 0, values_match.start()) if values_match else -1
+        columns_end = query.find(")", columns_start, values_match.start()) if columns_start != -1 else -1
+        if columns_end != -1:
             # Extract column names
-            columns_part = query.split("(")[1].split(")")[0].strip()
+            columns_part = query[columns_start + 1:columns_end]
             column_names = [col.strip() for col in columns_part.split(",")]
             
             # Get the actual table name
-            table_name = table_matches[0] if table_matches else None
+            table_name = table_match.group(1) if table_match else None
             actual_table = self.get_actual_table_name(table_name) if table_name else None
             
             if actual_table:
@@ -398,37 +510,36 @@ class SchemaValidator:
                     else:
                         new_columns.append(column_name)  # Keep original
                 
-                # Replace columns in the query
+                # Replace the column list only, not matching text elsewhere in the query
                 new_columns_str = ", ".join(new_columns)
-                query = query.replace(columns_part, new_columns_str)
+                query = query[:columns_start + 1] + new_columns_str + query[columns_end:]
         
         # Handle column references in UPDATE queries
-        if query_type == "UPDATE" and "SET" in query.upper():
-            # Extract SET clause
-            set_clause = query.upper().split("SET")[1].split("WHERE")[0].strip() if "WHERE" in query.upper() else query.upper().split("SET")[1].strip()
-            
+        set_match = _SET_CLAUSE_RE.search(query) if query_type == "UPDATE" else None
+        if set_match:
             # Get the actual table name
-            table_name = table_matches[0] if table_matches else None
+            table_name = table_match.group(1) if table_match else None
             actual_table = self.get_actual_table_name(table_name) if table_name else None
             
             if actual_table:
-                # Extract column assignments
-                assignments = set_clause.split(",")
+                # Extract column assignments, keeping the query's original case
+                assignments = set_match.group(1).split(",")
                 
-                for assignment in assignments:
+                for i, assignment in enumerate(assignments):
                     if "=" in assignment:
-                        column_name = assignment.split("=")[0].strip()
+                        column_part, value_part = assignment.split("=", 1)
+                        column_name = column_part.strip()
                         
                         actual_column = self.get_actual_column_name(actual_table, column_name)
                         
                         if actual_column and actual_column != column_name:
-                            # Replace column name in the query
-                            pattern = r'SET\s+(?:.*,\s*)?(' + re.escape(column_name) + r'\s*=)'
-                            replacement = f"SET {actual_column} ="
-                            query = re.sub(pattern, replacement, query, flags=re.IGNORECASE)
+                            # Replace only the column name of this assignment
+                            assignments[i] = column_part.replace(column_name, actual_column) + "=" + value_part
                             warnings.append(f"Column '{column_name}' was replaced with '{actual_column}'")
                         elif not actual_column:
                             warnings.append(f"Warning: Column '{column_name}' not found in table '{actual_table}'")
+                
+                query = query[:set_match.start(1)] + ",".join(assignments) + query[set_match.end(1):]
         
         return query, warnings
     
@@ -454,6 +565,26 @@ class SchemaValidator:
         # Get foreign keys that reference this table
         reverse_references = self._get_reverse_references(main_table)
         
+        # Fetch the referenced rows for each foreign key with one query for all
+        # data rows instead of one query per row
+        referenced_rows = {}
+        for fk_column, fk_info in fk_relationships.items():
+            fk_values = {row[fk_column] for row in data_rows if row.get(fk_column) is not None}
+            referenced_rows[fk_column] = self.fetch_referenced_rows(
+                fk_info['referred_table'], fk_info['referred_column'], fk_values
+            )
+        
+        # Likewise fetch the rows referencing any of the data rows with one query
+        # per referencing table; None means the batch failed and rows are fetched
+        # one by one below
+        related_rows_by_table = {}
+        for ref_table, ref_info in reverse_references.items():
+            local_column = ref_info['referred_column']
+            local_values = {row[local_column] for row in data_rows if row.get(local_column) is not None}
+            related_rows_by_table[ref_table] = self.fetch_related_rows_batch(
+                ref_table, ref_info['local_column'], local_values
+            )
+        
         # For each data row, resolve the foreign keys
         for row in data_rows:
             enriched_row = row.copy()
@@ -468,8 +599,12 @@ class SchemaValidator:
                     referred_table = fk_info['referred_table']
                     referred_column = fk_info['referred_column']
                     
-                    # Fetch the referenced row
-                    referenced_row = self.fetch_referenced_row(referred_table, referred_column, fk_value)
+                    # Look up the prefetched row, falling back to a direct fetch for
+                    # values the batch query couldn't match (e.g. differing types)
+                    fk_rows = referenced_rows[fk_column]
+                    if fk_value not in fk_rows:
+                        fk_rows[fk_value] = self.fetch_referenced_row(referred_table, referred_column, fk_value)
+                    referenced_row = fk_rows[fk_value]
                     
                     if referenced_row:
                         # Get descriptive field for display
@@ -501,8 +636,12 @@ class SchemaValidator:
                     foreign_column = ref_info['local_column']   # Column in the referencing table
                     
                     if local_column in row and row[local_column] is not None:
-                        # Fetch rows that reference this one
-                        related_rows = self.fetch_related_rows(ref_table, foreign_column, row[local_column])
+                        # Look up the rows that reference this one
+                        related_by_value = related_rows_by_table[ref_table]
+                        if related_by_value is None:
+                            related_rows = self.fetch_related_rows(ref_table, foreign_column, row[local_column])
+                        else:
+                            related_rows = related_by_value.get(row[local_column], [])
                         
                         if related_rows:
                             # Process into a simpler format
@@ -575,20 +714,49 @@ class SchemaValidator:
             query = f"SELECT * FROM {table} WHERE {column} = {value_str} LIMIT 1"
             
             with self.engine.connect() as conn:
-                result = conn.execute(text(query))
-                row = result.fetchone()
+                row = conn.execute(text(query)).mappings().fetchone()
                 
                 if row:
-                    row_dict = {}
-                    for i, col in enumerate(result.keys()):
-                        row_dict[col] = row[i]
-                    return row_dict
+                    return dict(row)
                 
                 return None
         except Exception:
             # If there's any error fetching the reference, just return None
             return None
     
+    def fetch_referenced_rows(self, table: str, column: str, values: Any) -> Dict[Any, Dict]:
+        """
+        Fetch the rows of a table whose column matches any of the given values
+        
+        Args:
+            table: The table to fetch from
+            column: The column to match on (usually primary key)
+            values: Collection of values to match
+            
+        Returns:
+            Dictionary mapping each matched value to its row data
+        """
+        if not values:
+            return {}
+            
+        try:
+            query = text(f"SELECT * FROM {table} WHERE {column} IN :values").bindparams(
+                bindparam("values", expanding=True)
+            )
+            
+            with self.engine.connect() as conn:
+                result = conn.execute(query, {"values": list(values)})
+                
+                rows_by_value = {}
+                for row in result.mappings():
+                    row_dict = dict(row)
+                    rows_by_value.setdefault(row_dict.get(column), row_dict)
+                
+                return rows_by_value
+        except Exception:
+            # If the batch fetch fails, callers fall back to fetching rows one by one
+            return {}
+    
     def fetch_related_rows(self, table: str, column: str, value: Any, limit: int = 5) -> List[Dict]:
         """
         Fetch rows from a table that reference a specific value
@@ -613,20 +781,49 @@ class SchemaValidator:
             
             with self.engine.connect() as conn:
                 result = conn.execute(text(query))
-                rows = result.fetchall()
-                
-                row_dicts = []
-                for row in rows:
-                    row_dict = {}
-                    for i, col in enumerate(result.keys()):
-                        row_dict[col] = row[i]
-                    row_dicts.append(row_dict)
-                
-                return row_dicts
+                return [dict(row) for row in result.mappings()]
         except Exception:
             # If there's any error fetching the references, just return empty list
             return []
     
+    def fetch_related_rows_batch(self, table: str, column: str, values: Any,
+                                 limit: int = 5) -> Optional[Dict[Any, List[Dict]]]:
+        """
+        Fetch the rows of a table that reference any of the given values
+        
+        Args:
+            table: The table to fetch from
+            column: The column to match on (foreign key)
+            values: Collection of values to match
+            limit: Maximum number of rows to keep per value
+            
+        Returns:
+            Dictionary mapping each matched value to its rows, or None if the query failed
+        """
+        if not values:
+            return {}
+            
+        try:
+            query = text(f"SELECT * FROM {table} WHERE {column} IN :values").bindparams(
+                bindparam("values", expanding=True)
+            )
+            
+            with self.engine.connect() as conn:
+                result = conn.execute(query, {"values": list(values)})
+                
+                # A per-value LIMIT isn't portable SQL, so extra rows are dropped here
+                rows_by_value = {}
+                for row in result.mappings():
+                    row_dict = dict(row)
+                    value_rows = rows_by_value.setdefault(row_dict.get(column), [])
+                    if len(value_rows) < limit:
+                        value_rows.append(row_dict)
+                
+                return rows_by_value
+        except Exception:
+            # If the batch fetch fails, callers fall back to fetching rows one by one
+            return None
+    
     def get_display_field(self, table: str, row: Dict) -> str:
         """
         Determine the best field to use for displaying a record
@@ -660,12 +857,14 @@ class SchemaValidator:
         # Default to id if nothing else works
         return 'id'
 
-    def execute_query_safely(self, query: str) -> Tuple[Dict[str, Any], List[str]]:
+    def execute_query_safely(self, query: str, format_table: bool = True) -> Tuple[Dict[str, Any], List[str]]:
         """
         Validate, adapt, and execute a SQL query safely with foreign key resolution
         
         Args:
             query: The SQL query to execute
+            format_table: Whether to render the rows as a text table in 'result';
+                          if False, 'result' only reports the number of rows
             
         Returns:
             Tuple of (result_dict, warning_messages)
@@ -689,24 +888,17 @@ class SchemaValidator:
                 if not rows:
                     return {"result": "Query executed successfully. No rows returned.", "data": []}, warnings
                 
-                # Get column names
-                column_names = result.keys()
-                
-                # Format results as a table
-                header = " | ".join(column_names)
-                separator = "-" * len(header)
-                output = f"{header}\n{separator}"
-                
                 # Convert rows to list of dicts for the data field
-                data = []
-                for row in rows:
-                    row_values = [str(value) for value in row]
-                    output += f"\n{' | '.join(row_values)}"
-                    
-                    data_row = {}
-                    for i, col in enumerate(column_names):
-                        data_row[col] = row[i]
-                    data.append(data_row)
+                data = [dict(row._mapping) for row in rows]
+                
+                if format_table:
+                    # Format results as a table
+                    header = " | ".join(result.keys())
+                    lines = [header, "-" * len(header)]
+                    lines.extend(" | ".join([str(value) for value in row]) for row in rows)
+                    output = "\n".join(lines)
+                else:
+                    output = f"Query executed successfully. {len(data)} rows returned."
                 
                 # Attempt to extract main table from query
                 main_table = self._extract_main_table_from_query(adapted_query)
@@ -743,9 +935,11 @@ class SchemaValidator:
             
             # Detect unknown column errors
             if "unknown column" in str(e).lower() or "no such column" in str(e).lower() or "column not found" in str(e).lower():
-                column_match = re.search(r"unknown column '([^']+)'", str(e).lower()) or \
-                              re.search(r"no such column[:]? ([^\s]+)", str(e).lower()) or \
-                              re.search(r"column '([^']+)' not found", str(e).lower())
+                column_match = None
+                for pattern in _UNKNOWN_COLUMN_RES:
+                    column_match = pattern.search(str(e).lower())
+                    if column_match:
+                        break
                               
                 if column_match:
                     problematic_column = column_match.group(1)
@@ -758,22 +952,24 @@ class SchemaValidator:
                         column_name = parts[1]
                         
                         # Try to find the actual table this alias refers to
-                        for table_name in self.tables_info.keys():
-                            # Look for any hints in the query like 'FROM table AS alias'
-                            alias_match = re.search(rf"from\s+{table_name}\s+(?:as\s+)?{table_alias}\b", query, re.IGNORECASE)
-                            if alias_match:
-                                # We found the table this alias refers to
-                                warnings.append(f"Table alias '{table_alias}' refers to table '{table_name}'")
-                                
-                                # List all available columns in this table
-                                column_list = list(self.tables_info[table_name]['columns'].keys())
-                                warnings.append(f"Available columns in table '{table_name}': {', '.join(column_list)}")
-                                
-                                # Check for similar column names
-                                actual_column = self.get_actual_column_name(table_name, column_name)
-                                if actual_column:
-                                    warnings.append(f"Suggestion: Column '{column_name}' might be '{actual_column}' in table '{table_name}'")
-                                break
+                        # ('FROM table AS alias' or 'JOIN table alias')
+                        table_name = next(
+                            (table for table, alias in extract_table_references(query)
+                             if alias.lower() == table_alias),
+                            None
+                        )
+                        if table_name in self.tables_info:
+                            # We found the table this alias refers to
+                            warnings.append(f"Table alias '{table_alias}' refers to table '{table_name}'")
+                            
+                            # List all available columns in this table
+                            column_list = list(self.tables_info[table_name]['columns'].keys())
+                            warnings.append(f"Available columns in table '{table_name}': {', '.join(column_list)}")
+                            
+                            # Check for similar column names
+                            actual_column = self.get_actual_column_name(table_name, column_name)
+                            if actual_column:
+                                warnings.append(f"Suggestion: Column '{column_name}' might be '{actual_column}' in table '{table_name}'")
                     else:
                         column_name = problematic_column
                         # Try to find this column in any of the tables used in the query
@@ -792,7 +988,7 @@ class SchemaValidator:
             
             # Detect unknown table errors
             elif "table" in str(e).lower() and ("not found" in str(e).lower() or "doesn't exist" in str(e).lower()):
-                table_match = re.search(r"table ['\"]?([^'\"\s]+)['\"]?(?:\S+)? (?:not found|doesn't exist)", str(e).lower())
+                table_match = _MISSING_TABLE_RE.search(str(e).lower())
                 if table_match:
                     problematic_table = table_match.group(1)
                     
@@ -823,7 +1019,7 @@ class SchemaValidator:
             tables_in_query = self._extract_tables_from_query(original_query)
             
             # Check for unknown column errors
-            unknown_column_match = re.search(r"Unknown column '([^']+)'", error_message)
+            unknown_column_match = _UNKNOWN_COLUMN_ERROR_RE.search(error_message)
             problematic_column = None
             problematic_table_alias = None
             
@@ -836,7 +1032,7 @@ class SchemaValidator:
                     problematic_column = parts[1]
             
             # Check for unknown table errors
-            unknown_table_match = re.search(r"Table '([^']+)' doesn't exist", error_message)
+            unknown_table_match = _UNKNOWN_TABLE_ERROR_RE.search(error_message)
             problematic_table = None
             if unknown_table_match:
                 problematic_table = unknown_table_match.group(1)
@@ -893,21 +1089,20 @@ class SchemaValidator:
                 
                 # Format results as a table
                 header = " | ".join(column_names)
-                separator = "-" * len(header)
-                output = f"Fallback query executed instead of the original query.\n\nFallback query: {fallback_query}{error_detail}\n\n{header}\n{separator}"
+                lines = [
+                    f"Fallback query executed instead of the original query.\n\nFallback query: {fallback_query}{error_detail}\n\n{header}",
+                    "-" * len(header)
+                ]
                 
                 # Convert rows to list of dicts for the data field
                 data = []
                 for row in rows:
                     # Basic row values for output
-                    row_values = [str(value) for value in row]
-                    output += f"\n{' | '.join(row_values)}"
+                    lines.append(" | ".join([str(value) for value in row]))
                     
                     # Build data row
-                    data_row = {}
-                    for i, col in enumerate(column_names):
-                        data_row[col] = row[i]
-                    data.append(data_row)
+                    data.append(dict(row._mapping))
+                output = "\n".join(lines)
                 
                 # Resolve foreign key references for the data
                 normalized_data = self.resolve_foreign_keys(data, main_table)
@@ -934,13 +1129,14 @@ class SchemaValidator:
             Main table name or None if not found
         """
         # For SELECT queries
-        if "FROM " in query.upper():
-            after_from = query.upper().split("FROM ")[1].strip()
+        from_match = _FROM_KEYWORD_RE.search(query)
+        if from_match:
             # Extract table name (handles cases with WHERE, JOIN, etc.)
-            table_parts = re.split(r'\s+', after_from, 1)
-            table_name = table_parts[0].strip()
+            table_parts = query[from_match.end():].split(None, 1)
+            if not table_parts:
+                return None
             # Remove any trailing comma or semicolon
-            table_name = table_name.rstrip(',;')
+            table_name = table_parts[0].rstrip(',;')
             
             # Get the actual table name
             actual_table = self.get_actual_table_name(table_name)
@@ -987,18 +1183,5 @@ class SchemaValidator:
         Returns:
             List of table names found in the query
         """
-        tables = []
-        
-        # Extract table names from FROM clauses
-        from_matches = re.findall(r'\bFROM\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', query, re.IGNORECASE)
-        for match in from_matches:
-            table_name = match[0]
-            tables.append(table_name)
-        
-        # Extract table names from JOIN clauses
-        join_matches = re.findall(r'\bJOIN\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', query, re.IGNORECASE)
-        for match in join_matches:
-            table_name = match[0]
-            tables.append(table_name)
-        
-        return tables
\ No newline at end of file
+        # Table names from FROM and JOIN clauses
+        return [table_name for table_name, _ in extract_table_references(query)]
\ No newline at end of file
@@ -0,0 +1,251 @@
+import re
+from functools import lru_cache
+from typing import Dict, Any, Optional, Tuple
+
+# Single pass tokenizer: literals and comments are matched as whole tokens so
+# keywords inside them are never mistaken for SQL structure
+_TOKEN_RE = re.compile(r"""
+      (?P<string>'(?:[^']|'')*'?)
+    | (?P<quoted>"(?:[^"]|"")*"?|`[^`]*`?|\[[^\]]*\]?)
+    | (?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+    | (?P<open>\()
+    | (?P<close>\))
+    | (?P<comma>,)
+    | (?P<word>[A-Za-z_][\w$]*)
+""", re.VERBOSE | re.DOTALL)
+
+# Keywords that end the FROM part of a SELECT statement
+CLAUSE_KEYWORDS = frozenset(["WHERE", "GROUP", "HAVING", "ORDER", "LIMIT"])
+
+# Keywords that can follow a table reference and so can't be its alias
+_NON_ALIAS_KEYWORDS = CLAUSE_KEYWORDS | frozenset([
+    "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "OUTER", "CROSS", "NATURAL",
+    "STRAIGHT_JOIN", "ON", "USING", "UNION", "INTERSECT", "EXCEPT", "OFFSET",
+    "WINDOW", "FOR", "SET", "VALUES", "SELECT", "FROM"
+])
+
+@lru_cache(maxsize=1024)
+def tokenize(query: str) -> Tuple[Tuple[str, str, int, int, int], ...]:
+    """
+    Tokenize a query once; every helper in this module works from this result
+
+    Args:
+        query: SQL query string
+
+    Returns:
+        Tuple of (kind, text, start, end, depth) entries where kind is 'word',
+        'quoted' or 'comma' and depth is the parenthesis nesting level.
+        String literals and comments are dropped.
+    """
+    tokens = []
+    depth = 0
+
+    for match in _TOKEN_RE.finditer(query):
+        kind = match.lastgroup
+        if kind == "open":
+            depth += 1
+        elif kind == "close":
+            depth = max(depth - 1, 0)
+        elif kind in ("word", "quoted", "comma"):
+            tokens.append((kind, match.group(), match.start(), match.end(), depth))
+
+    return tuple(tokens)
+
+@lru_cache(maxsize=1024)
+def top_level_tokens(query: str) -> Tuple[Tuple[str, str, int, int], ...]:
+    """
+    Tokenize a query, keeping only identifiers and keywords outside parentheses
+
+    Args:
+        query: SQL query string
+
+    Returns:
+        Tuple of (kind, text, start, end) entries where kind is 'word' or 'quoted'.
+        Words are uppercased; quoted identifiers keep their original text.
+    """
+    return tuple(
+        (kind, text.upper() if kind == "word" else text, start, end)
+        for kind, text, start, end, depth in tokenize(query)
+        if depth == 0 and kind != "comma"
+    )
+
+def unquote_identifier(identifier: str) -> str:
+    """Strip MySQL, ANSI or SQL Server quoting from an identifier"""
+    if len(identifier) >= 2 and identifier[0] in '`"[':
+        return identifier[1:-1]
+    return identifier
+
+def analyze_select(query: str) -> Optional[Dict[str, Any]]:
+    """
+    Locate the parts of a SELECT statement used when rewriting it
+
+    Only the outermost statement is considered, so FROM/WHERE keywords inside
+    subqueries, string literals or comments are ignored.
+
+    Args:
+        query: SQL query string
+
+    Returns:
+        Dictionary with 'select_list', 'select_span', 'main_table' and
+        'trailing_clauses' (all in the query's original case), or None if the
+        query is not a SELECT ... FROM statement
+    """
+    tokens = top_level_tokens(query)
+    if not tokens or tokens[0][:2] != ("word", "SELECT"):
+        return None
+
+    from_index = next(
+        (i for i, token in enumerate(tokens) if token[:2] == ("word", "FROM")), None
+    )
+    if from_index is None:
+        return None
+
+    select_start = tokens[0][3]
+    select_end = tokens[from_index][2]
+    select_list = query[select_start:select_end].strip()
+
+    # The table must directly follow FROM; anything else is a derived table
+    main_table = None
+    if from_index + 1 < len(tokens):
+        _, _, table_start, table_end = tokens[from_index + 1]
+        if not query[select_end + 4:table_start].strip():
+            main_table = unquote_identifier(query[table_start:table_end])
+
+    trailing_clauses = None
+    for kind, text, start, _ in tokens[from_index + 1:]:
+        if kind == "word" and text in CLAUSE_KEYWORDS:
+            trailing_clauses = query[start:].strip()
+            break
+
+    return {
+        "select_list": select_list,
+        "select_span": (select_start, select_end),
+        "main_table": main_table,
+        "trailing_clauses": trailing_clauses
+    }
+
+# Clauses of a SELECT statement in the order they must appear
+CLAUSE_NAMES = ("select", "from", "where", "group_by", "having", "order_by", "limit")
+
+_CLAUSE_STARTS = {
+    "FROM": "from",
+    "WHERE": "where",
+    "GROUP": "group_by",
+    "HAVING": "having",
+    "ORDER": "order_by",
+    "LIMIT": "limit"
+}
+
+def split_clauses(query: str) -> Dict[str, str]:
+    """
+    Split a SELECT statement into its top-level clauses in one pass
+
+    Args:
+        query: SQL query string
+
+    Returns:
+        Dictionary keyed by CLAUSE_NAMES with the body of each clause in the
+        query's original case, without its keyword. Missing clauses are ''.
+    """
+    clauses = dict.fromkeys(CLAUSE_NAMES, "")
+    tokens = top_level_tokens(query)
+    if not tokens or tokens[0][:2] != ("word", "SELECT"):
+        return clauses
+
+    # (clause name, start of clause body, start of clause keyword)
+    bounds = [("select", tokens[0][3], tokens[0][2])]
+    last_index = 0
+    for i in range(1, len(tokens)):
+        kind, text, start, end = tokens[i]
+        name = _CLAUSE_STARTS.get(text) if kind == "word" else None
+        if name is None or CLAUSE_NAMES.index(name) <= last_index:
+            continue
+        if text in ("GROUP", "ORDER"):
+            if i + 1 >= len(tokens) or tokens[i + 1][1] != "BY":
+                continue
+            end = tokens[i + 1][3]
+        bounds.append((name, end, start))
+        last_index = CLAUSE_NAMES.index(name)
+
+    # Each clause runs up to the keyword of the next one
+    body_ends = [keyword_start for _, _, keyword_start in bounds[1:]] + [len(query)]
+    for (name, body_start, _), body_end in zip(bounds, body_ends):
+        clauses[name] = query[body_start:body_end].strip().rstrip(";").strip()
+
+    return clauses
+
+@lru_cache(maxsize=1024)
+def extract_table_references(query: str) -> Tuple[Tuple[str, str], ...]:
+    """
+    Find the tables named after FROM and JOIN, including comma-separated lists
+    and tables referenced inside subqueries
+
+    Keywords following a table (WHERE, LEFT, ON, ...) are never taken as its
+    alias, and keywords inside string literals or comments are ignored.
+
+    Args:
+        query: SQL query string
+
+    Returns:
+        Tuple of (table, alias) pairs in query order, alias being '' if the
+        table has none. Quoted identifiers are unquoted.
+    """
+    tokens = [(kind, text) for kind, text, _, _, _ in tokenize(query)]
+
+    def is_name(index):
+        if index >= len(tokens):
+            return False
+        kind, text = tokens[index]
+        return kind == "quoted" or (kind == "word" and text.upper() not in _NON_ALIAS_KEYWORDS)
+
+    references = []
+    i = 0
+    while i < len(tokens):
+        kind, text = tokens[i]
+        i += 1
+        if kind != "word" or text.upper() not in ("FROM", "JOIN"):
+            continue
+
+        while is_name(i):
+            table = unquote_identifier(tokens[i][1])
+            i += 1
+
+            alias = ""
+            if i < len(tokens) and tokens[i][0] == "word" and tokens[i][1].upper() == "AS":
+                i += 1
+            if is_name(i):
+                alias = unquote_identifier(tokens[i][1])
+                i += 1
+
+            references.append((table, alias))
+
+            # FROM a, b lists more tables
+            if i < len(tokens) and tokens[i][0] == "comma":
+                i += 1
+            else:
+                break
+
+    return tuple(references)
+
+@lru_cache(maxsize=1024)
+def extract_tables(query: str) -> Tuple[Optional[str], Tuple[str, ...]]:
+    """
+    Find the main table of a query and every table it reads from
+
+    Args:
+        query: SQL query string
+
+    Returns:
+        (main_table, tables) where main_table is the table after the outermost
+        FROM (or the first table named, for other statements), or None, and
+        tables lists every table named after FROM or JOIN in query order
+    """
+    tables = tuple(table for table, _ in extract_table_references(query))
+
+    select_parts = analyze_select(query)
+    if select_parts is not None:
+        main_table = select_parts["main_table"]
+    else:
+        main_table = tables[0] if tables else None
+
+    return main_table, tables